@@ -1,17 +1,88 @@
 import cv2
 import numpy as np
-import random
 import os
-from scipy.stats import lognorm
+import io
+import copy
 from tqdm import tqdm
 import names
 import argparse
+import multiprocessing
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from video_writers import VIDEO_CODECS, PngSequenceWriter, PartedVideoWriter, open_stream_writer, encode_image_sequence
+from ground_truth import GroundTruthWriter
+from profiling import StageTimer, print_report
+from backgrounds import open_background_source
+from spatial_hash import SpatialHash
+from frame_stream import prefetch_iter
+from frame_store import OUTPUT_FORMATS, output_path, open_frame_store
+from checkpoint import save_checkpoint, load_checkpoint, remove_checkpoint, open_text_output, start_without_checkpoint
+from sensor_noise import make_sensor_noise
+
+# Simulated state of one frame: the particle registers, the highlight polygon of each blob
+# and the ids of the particles in each register slot (a respawned particle gets a new id).
+# On checkpoint frames, checkpoint holds what simulate_frames needs to continue after the frame
+FrameState = namedtuple("FrameState", ["circles_register", "blobs_register", "blob_polygons", "circle_ids", "blob_ids",
+                                       "frame", "checkpoint"], defaults=(None,))
+
+IPI_GROUND_TRUTH_COLUMNS = [
+    ("frame", np.int64), ("object_id", np.int64), ("type", "U6"), ("x", np.int64), ("y", np.int64),
+    ("radius", np.int64), ("fringe_count", np.int64),
+]
+
+class SpriteCache:
+    """Bounded LRU cache of pre-rendered sprites with hit/miss counters"""
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._sprites = OrderedDict()
+
+    def get(self, key, render):
+        """Return the sprite stored under key, rendering and storing it on a miss"""
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self.hits += 1
+            self._sprites.move_to_end(key)
+            return sprite
+        self.misses += 1
+        sprite = render()
+        if self.max_size > 0:
+            self._sprites[key] = sprite
+            if len(self._sprites) > self.max_size:
+                self._sprites.popitem(last=False)
+        return sprite
+
+    def __len__(self):
+        return len(self._sprites)
+
+# Creator and optional frame encoder held by each render worker process
+_worker_creator = None
+_worker_encoder = None
+
+def _init_render_worker(creator, encoder):
+    global _worker_creator, _worker_encoder
+    _worker_creator = creator
+    _worker_encoder = encoder
+
+def _render_worker_frame(state):
+    image = _worker_creator.render_frame(state)
+    if _worker_encoder is not None:
+        return _worker_encoder.encode(image)
+    return image
 
 class CircleImageCreator:
     def __init__(self, rmin=30, rmax=80, vitx=20, vity=10, fps=30, video_duration=4,
                  n_circles=20, n_blobs=5, apply_blur=True, blur_radius=5, apply_rotation=True,
                  use_background_image=False, background_image_path=None,
-                 save_path=None, output_video_path=None):
+                 save_path=None, output_video_path=None, sprite_cache_size=256,
+                 stream_video=False, n_workers=1, max_pending_frames=None, ground_truth_format="csv",
+                 seed=None, profile=False, dirty_blur=False, grayscale=False, bit_depth=8,
+                 min_separation=None, max_overlap=None, max_placement_attempts=100,
+                 codec=None, quality=None, segment_frames=0, encode_workers=None, output_format="video",
+                 resolution=(2 * 1024, 1024), tile_memory_mb=None, checkpoint_interval=0,
+                 gain=1.0, shot_noise=0.0, read_noise=0.0, fixed_pattern_noise=0.0):
         # Get the script directory
         script_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -20,14 +91,44 @@ class CircleImageCreator:
         self.save_path = save_path or os.path.join(script_dir, "Images")
         self.output_video_path = output_video_path or script_dir
 
-        # Background options
+        # Background options: the path may be an image, a directory of images or a video
         self.use_background_image = use_background_image
-        self.background_resolution = (2*1024, 1024)
+        self.background_resolution = tuple(resolution)
+        self.background_source = None
+        self._background_missing = False
+        self._frame_buffer = None
+        # Output format: BGR or single-channel frames, 8 or 16 bits per channel
+        if bit_depth not in (8, 16):
+            raise ValueError(f"bit_depth must be 8 or 16, got {bit_depth}")
+        self.grayscale = grayscale
+        self.bit_depth = bit_depth
+        self.dtype = np.uint16 if bit_depth == 16 else np.uint8
+        # Video encoding: libx264, ffv1 or mjpeg (default libx264, FFV1 for 16-bit) and its quality.
+        # make_video_file encodes segments of segment_frames frames on encode_workers processes
+        self.codec = codec or ("ffv1" if bit_depth == 16 else "libx264")
+        if self.codec not in VIDEO_CODECS:
+            raise ValueError(f"codec must be one of {', '.join(VIDEO_CODECS)}, got {self.codec}")
+        if bit_depth == 16 and self.codec != "ffv1":
+            raise ValueError("16-bit video is only written with the ffv1 codec")
+        self.quality = quality
+        # Without ffmpeg, streamed video may only fall back to MJPG if no codec or quality was asked for
+        self.mjpg_fallback = codec is None and quality is None
+        self.segment_frames = segment_frames
+        self.encode_workers = encode_workers
         # Circle parameters
         self.rmin = rmin
         self.rmax = rmax
         self.vitx = vitx
         self.vity = vity
+        # Optional overlap control when particles spawn: min_separation is the gap required between
+        # disk edges, max_overlap the fraction of the smaller diameter two disks may overlap by.
+        # Each particle gets at most max_placement_attempts positions before it is placed anyway
+        self.min_separation = min_separation
+        self.max_overlap = max_overlap
+        self.max_placement_attempts = max_placement_attempts
+        self.placements = 0
+        self.placement_attempts = 0
+        self.placement_failures = 0
         # Video parameters
         self.video_duration = video_duration
         self.fps = fps
@@ -37,143 +138,802 @@ class CircleImageCreator:
         self.n_circles = n_circles
         self.n_blobs = n_blobs
         self.save = True
-        self.make_video = True
+        # Encoded video, or the raw frames in a memory-mapped .npy array or an HDF5 file
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}, got {output_format}")
+        self.output_format = output_format
+        self.make_video = output_format == "video"
+        # Pipe frames straight into the encoder instead of writing PNGs to save_path
+        self.stream_video = stream_video
+        # Render frames on a process pool when n_workers > 1, with at most
+        # max_pending_frames in flight (default 2 * n_workers)
+        self.n_workers = n_workers
+        self.max_pending_frames = max_pending_frames
+        # Per-object ground truth file format: csv, npz or parquet
+        self.ground_truth_format = ground_truth_format
+        # Save a checkpoint every checkpoint_interval frames (0: never) for create_images to resume from
+        if checkpoint_interval and ground_truth_format != "csv":
+            raise ValueError("Checkpoints need csv ground truth")
+        self.checkpoint_interval = checkpoint_interval
+        # Opt-in per-stage timing, written to profile_{ext}.json
+        self.profile = profile
+        self.timer = StageTimer(profile)
         # Post-processing options
         self.apply_blur = apply_blur
         self.blur_radius = blur_radius
         self.blur_kernel = (blur_radius * 2 + 1, blur_radius * 2 + 1)
+        # With a static background, blur it once and only re-blur the neighborhoods of objects
+        self.dirty_blur = dirty_blur
+        self._blurred_background = None
         self.apply_rotation = apply_rotation
         self.rotation_angle = cv2.ROTATE_90_CLOCKWISE
         # Fringe probability distribution parameters
         self.fringe_mean = 1.5
         self.fringe_sigma = 0.5
+        # Single random stream for every draw of the simulation; a seed makes runs reproducible
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy % 2 ** 63)
+        self.rng = np.random.default_rng(self.seed)
+        # Optional camera sensor model applied to the rendered frames (see sensor_noise.SensorNoise)
+        self.gain = gain
+        self.shot_noise = shot_noise
+        self.read_noise = read_noise
+        self.fixed_pattern_noise = fixed_pattern_noise
+        self.sensor_noise = make_sensor_noise(self.seed, gain, shot_noise, read_noise, fixed_pattern_noise)
+        # Per-radius blob gradient stamps, filled lazily by blob_stamp
+        self._blob_stamps = {}
+        # Fringed circle sprites keyed by (radius, fringe count, color)
+        self.circle_sprites = SpriteCache(sprite_cache_size)
+        # Render frames tile by tile, keeping the tile buffers within tile_memory_mb (None: whole frames)
+        self.tile_memory_mb = tile_memory_mb
+        if tile_memory_mb is not None:
+            self.tiles()
 
-    def create_background(self):
-        """Create background image based on settings"""
+    def open_background(self):
+        """Load the background image(s) once; frames without one use a black background"""
+        self.close_background()
         if self.use_background_image:
-            image = cv2.imread(self.path)
-            if image is None:
-                image = np.zeros((self.background_resolution[1], self.background_resolution[0], 3), dtype=np.uint8)
-        else:
-            image = np.zeros((self.background_resolution[1], self.background_resolution[0], 3), dtype=np.uint8)
-        return image
+            self.background_source = open_background_source(self.path, self.background_resolution,
+                                                             grayscale=self.grayscale, dtype=self.dtype)
+            self._background_missing = self.background_source is None
+            if self._background_missing:
+                print(f"Could not read background from {self.path}, using a black background.")
+
+    def close_background(self):
+        self._blurred_background = None
+        if self.background_source is not None:
+            self.background_source.close()
+            self.background_source = None
+
+    def background(self, frame=0):
+        """Return the shared, read-only background of a frame"""
+        if self.use_background_image and self.background_source is None and not self._background_missing:
+            self.open_background()
+        if self.background_source is not None:
+            return self.background_source.get(frame)
+        return np.broadcast_to(self.dtype(0), self.frame_shape())
+
+    def frame_shape(self):
+        """Return the array shape of a frame before rotation"""
+        width, height = self.background_resolution
+        return (height, width) if self.grayscale else (height, width, 3)
+
+    def output_shape(self):
+        """Return the array shape of a frame after rotation"""
+        shape = self.frame_shape()
+        if self.apply_rotation and self.rotation_angle in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE):
+            return (shape[1], shape[0]) + shape[2:]
+        return shape
+
+    def pixel(self, bgr):
+        """Return the frame value of an 8-bit BGR color: its blue channel in grayscale, scaled to the bit depth"""
+        scale = 257 if self.bit_depth == 16 else 1
+        if self.grayscale:
+            return int(bgr[0]) * scale
+        return tuple(int(c) * scale for c in bgr)
+
+    def create_background(self, frame=0):
+        """Create background image based on settings"""
+        return np.array(self.background(frame))
+
+    def frame_buffer(self, frame=0):
+        """Copy the background of a frame into the reusable frame buffer and return the buffer"""
+        background = self.background(frame)
+        if self._frame_buffer is None or self._frame_buffer.shape != background.shape:
+            self._frame_buffer = np.empty(background.shape, dtype=self.dtype)
+        np.copyto(self._frame_buffer, background)
+        return self._frame_buffer
+
+    def circles_creator(self, taille, n):
+        """Create n circles with random properties, one register row (plx, ply, radius, nf, IB, color) each"""
+        margin = int(self.rmax * 1.5)
+        plx = self.rng.integers(margin, taille[0] - margin, n)
+        ply = self.rng.integers(margin, taille[1] - margin, n)
+        radius = self.rng.integers(self.rmin, self.rmax, n)
+        color = 170 + self.rng.integers(0, 70, n)
+        nf = np.round(self.rng.lognormal(self.fringe_mean, self.fringe_sigma, n))
+        IB = self.rng.random(n) * self.rmax / radius
+        return np.column_stack([plx, ply, radius, nf, IB, color]).astype(float)
+
+    def blobs_creator(self, taille, n):
+        """Create n blobs with random properties, one register row (plx, ply, radius, b, g, r, IB) each"""
+        margin = int(self.rmax * 1.5)
+        plx = self.rng.integers(margin, taille[0] - margin, n)
+        ply = self.rng.integers(margin, taille[1] - margin, n)
+        radius = self.rng.integers(self.rmin, self.rmax, n)
+        colors = self.rng.integers(50, 200, (n, 3))
+        IB = self.rng.random(n)
+        return np.column_stack([plx, ply, radius, colors, IB]).astype(float)
+
+    def overlap_grid(self):
+        """Return an empty SpatialHash for the overlap constraint, or None when it is off"""
+        if self.min_separation is None and self.max_overlap is None:
+            return None
+        return SpatialHash(self.rmax, self.min_separation or 0.0, self.max_overlap or 0.0)
+
+    def place(self, register, rows, taille, grid):
+        """Move the given register rows to random positions compatible with the particles of grid,
+        adding them to it; a row that finds none within max_placement_attempts keeps its last draw"""
+        margin = int(self.rmax * 1.5)
+        for i in rows:
+            attempts = 1
+            while not grid.is_clear(*register[i, :3]) and attempts < self.max_placement_attempts:
+                register[i, 0] = self.rng.integers(margin, taille[0] - margin)
+                register[i, 1] = self.rng.integers(margin, taille[1] - margin)
+                attempts += 1
+            if attempts == self.max_placement_attempts and not grid.is_clear(*register[i, :3]):
+                self.placement_failures += 1
+            self.placements += 1
+            self.placement_attempts += attempts
+            grid.insert(*register[i, :3])
 
     def unique_circle_creator(self, taille):
         """Create a unique circle with random properties"""
-        plx = np.random.randint(self.rmax * 1.5, taille[0] - self.rmax * 1.5)
-        ply = np.random.randint(self.rmax * 1.5, taille[1] - self.rmax * 1.5)
-        radius = np.random.randint(self.rmin, self.rmax)
-        color = 170 + np.random.randint(0, 70)
-        nf = int(np.round(lognorm.rvs(s=self.fringe_sigma, scale=np.exp(self.fringe_mean))))
-        IB = np.random.rand() * self.rmax / radius
-        return plx, ply, radius, nf, IB, color
+        return tuple(self.circles_creator(taille, 1)[0])
 
     def unique_blob_creator(self, taille):
         """Create a unique blob with random properties"""
-        plx = np.random.randint(self.rmax * 1.5, taille[0] - self.rmax * 1.5)
-        ply = np.random.randint(self.rmax * 1.5, taille[1] - self.rmax * 1.5)
-        radius = np.random.randint(self.rmin, self.rmax)
-        color_b = np.random.randint(50, 200)
-        color_g = np.random.randint(50, 200)
-        color_r = np.random.randint(50, 200)
-        IB = np.random.rand()
-        return plx, ply, radius, color_b, color_g, color_r, IB
-
-    def create_images(self):
-        """Generate sequence of images with circles and blobs"""
-        print("Starting image generation...")
-        ext = names.get_first_name(gender='male')
-        image = self.create_background()
+        return tuple(self.blobs_creator(taille, 1)[0])
+
+    def blob_stamp(self, radius):
+        """Return the disk mask and gradient color indices for a blob radius (cached)"""
+        radius = int(radius)
+        stamp = self._blob_stamps.get(radius)
+        if stamp is None:
+            offsets = np.arange(-radius, radius)
+            d2 = offsets[np.newaxis, :] ** 2 + offsets[:, np.newaxis] ** 2
+            mask = d2 <= radius ** 2
+            color_index = np.clip(radius - np.sqrt(d2).astype(int), 0, radius - 1)
+            stamp = (mask, color_index)
+            self._blob_stamps[radius] = stamp
+        return stamp
+
+    def draw_blob_gradient(self, image, plx, ply, radius, color):
+        """Paint the radial color gradient of a blob in place over its bounding box"""
+        plx, ply, radius = int(plx), int(ply), int(radius)
+        if radius <= 0:
+            return image
+        gradient = np.linspace(0, 1, radius)
+        colors = np.zeros((radius, 3), dtype=int)
+        colors[:, 0] = (color[0] * (1 - gradient)).astype(int)
+        colors[:, 1] = (color[1] * (1 - gradient)).astype(int)
+        colors[:, 2] = (color[2] * gradient).astype(int)
+        if self.bit_depth == 16:
+            colors *= 257
+        if self.grayscale:
+            colors = colors[:, 0]
+        mask, color_index = self.blob_stamp(radius)
+        box = self.clip_box(image, plx - radius, ply - radius, mask.shape)
+        if box is None:
+            return image
+        region, stamp = box
+        mask = mask[stamp]
+        image[region][mask] = colors[color_index[stamp][mask]]
+        return image
+
+    @staticmethod
+    def clip_box(image, x0, y0, shape):
+        """Return (image slices, stamp slices) of a stamp placed at (x0, y0), cropped to the image"""
+        cx0, cy0 = max(x0, 0), max(y0, 0)
+        cx1, cy1 = min(x0 + shape[1], image.shape[1]), min(y0 + shape[0], image.shape[0])
+        if cx0 >= cx1 or cy0 >= cy1:
+            return None
+        region = (slice(cy0, cy1), slice(cx0, cx1))
+        stamp = (slice(cy0 - y0, cy1 - y0), slice(cx0 - x0, cx1 - x0))
+        return region, stamp
+
+    def render_circle_sprite(self, radius, nf, color):
+        """Render a fringed circle once into a small patch and the mask of its drawn pixels"""
+        dl = 2 * radius / (nf + 1)
+        half = radius + max(1, int(dl / 2)) + 2
+        size = 2 * half + 1
+        patch = np.zeros((size, size) if self.grayscale else (size, size, 3), dtype=self.dtype)
+        mask = np.zeros((size, size), dtype=np.uint8)
+        for layer, circle_color, line_color in ((patch, self.pixel((color, 100, 0)), self.pixel((15, 5, 5))),
+                                                (mask, 255, 255)):
+            cv2.circle(layer, (half, half), radius, circle_color, -1)
+            for j in range(1, nf + 1):
+                d0 = abs(radius - int(j * dl))
+                dy = int(np.sqrt(radius ** 2 - d0 ** 2)) - 2
+                dx = radius - int(j * dl)
+                th = max(1, int(dl / 2))
+                cv2.line(layer, (half + dx, half - dy), (half + dx, half + dy), line_color, th)
+        return patch, mask.astype(bool)
+
+    def draw_circle(self, image, plx, ply, radius, nf, color):
+        """Composite the cached sprite of a fringed circle centred on (plx, ply)"""
+        radius, nf, color = int(radius), int(nf), int(color)
+        patch, mask = self.circle_sprites.get((radius, nf, color),
+                                              lambda: self.render_circle_sprite(radius, nf, color))
+        half = patch.shape[0] // 2
+        box = self.clip_box(image, int(plx) - half, int(ply) - half, mask.shape)
+        if box is None:
+            return image
+        region, stamp = box
+        mask = mask[stamp]
+        image[region][mask] = patch[stamp][mask]
+        return image
+
+    def video_file_path(self, ext):
+        """Return the path of the output video (or frame store) for a run name"""
+        return output_path(os.path.join(self.output_video_path, f"Vid_{ext}.avi"), self.output_format)
+
+    def video_codec(self):
+        """Return the ffmpeg (codec, pixel format) of the output video"""
+        if self.bit_depth == 16:
+            return self.codec, "gray16le" if self.grayscale else "gbrp16le"
+        if self.grayscale and self.codec != "mjpeg":
+            return self.codec, "gray"
+        return self.codec, VIDEO_CODECS[self.codec]
+
+    def open_frame_writer(self, ext, start=0):
+        """Return the frame writer: a frame store, a streaming encoder, or PNG frames for make_video_file
+
+        start is the first frame to write when resuming. With checkpoints a streamed video is
+        encoded in one part per checkpoint interval, so a resumed run keeps the finished parts.
+        """
+        if not self.make_video:
+            return open_frame_store(self.video_file_path(ext), self.n_pic, self.fps, start)
+        if self.stream_video and self.checkpoint_interval:
+            codec, pix_fmt = self.video_codec()
+            return PartedVideoWriter(self.video_file_path(ext),
+                                     partial(open_stream_writer, fps=self.fps, codec=codec, pix_fmt=pix_fmt,
+                                             quality=self.quality),
+                                     self.checkpoint_interval, self.n_pic, start)
+        if self.stream_video:
+            return open_stream_writer(self.video_file_path(ext), self.fps, *self.video_codec(), self.quality,
+                                      fallback=self.mjpg_fallback)
+        return PngSequenceWriter(self.save_path, start=start)
+
+    def blob_polygon(self, plx, ply, radius, num_points=10):
+        """Draw the random highlight polygon of a blob, as points inside its disk"""
+        x0, y0, size = int(plx) - int(radius), int(ply) - int(radius), 2 * int(radius) + 1
+        points = np.empty((0, 2), dtype=int)
+        while len(points) < num_points:
+            candidates = self.rng.integers(0, size, (2 * num_points, 2)) + (x0, y0)
+            inside = (candidates[:, 0] - plx) ** 2 + (candidates[:, 1] - ply) ** 2 <= radius ** 2
+            points = np.concatenate([points, candidates[inside]])
+        return points[:num_points].astype(np.int32).reshape((-1, 1, 2))
+
+    def advance_register(self, register, speed_column, draws, taille):
+        """Move every particle of a register by one frame in place, returning the mask of
+        particles that left the image or were picked for a random respawn"""
+        register[:, 0] = np.trunc(register[:, 0] + self.vitx * self.dt * register[:, speed_column] * 10 * draws[:, 0])
+        register[:, 1] = np.trunc(register[:, 1] + self.vity * self.dt * register[:, speed_column] * 10 * draws[:, 1])
+        return ((register[:, 0] > taille[0]) | (register[:, 0] < 0) |
+                (register[:, 1] > taille[1]) | (register[:, 1] < 0) |
+                (draws[:, 2] < 0.05))
+
+    def simulate_frames(self, taille, f2, checkpoint=None):
+        """Advance the particles frame by frame, yielding the state needed to render each frame
+
+        With checkpoint_interval, every checkpoint_interval-th state carries a checkpoint; passing
+        one back continues the simulation after its frame exactly as the original run did.
+        """
+        grid = self.overlap_grid()
+        if checkpoint is None:
+            circles_register = self.circles_creator(taille, self.n_circles)
+            blobs_register = self.blobs_creator(taille, self.n_blobs)
+            self.placements = self.placement_attempts = self.placement_failures = 0
+            if grid is not None:
+                self.place(circles_register, range(self.n_circles), taille, grid)
+                self.place(blobs_register, range(self.n_blobs), taille, grid)
+            f2.write("".join(f"{nf} " for nf in circles_register[:, 3]))
+            # Circles are numbered first, then blobs; respawned particles take the next free id
+            circle_ids = np.arange(self.n_circles)
+            blob_ids = np.arange(self.n_circles, self.n_circles + self.n_blobs)
+            next_id = self.n_circles + self.n_blobs
+            start = 0
+        else:
+            circles_register, blobs_register = checkpoint["circles_register"].copy(), checkpoint["blobs_register"].copy()
+            circle_ids, blob_ids = checkpoint["circle_ids"].copy(), checkpoint["blob_ids"].copy()
+            next_id = checkpoint["next_id"]
+            self.placements, self.placement_attempts, self.placement_failures = checkpoint["placements"]
+            self.rng.bit_generator.state = checkpoint["rng"]
+            start = checkpoint["frame"] + 1
+        for count in range(start, self.n_pic):
+            # One batch of uniform draws per register and frame: x step, y step, respawn test
+            circle_draws = self.rng.random((self.n_circles, 3))
+            blob_draws = self.rng.random((self.n_blobs, 3))
+            circles_respawned = self.advance_register(circles_register, 4, circle_draws, taille)
+            blobs_respawned = self.advance_register(blobs_register, 6, blob_draws, taille)
+            if grid is not None and (circles_respawned.any() or blobs_respawned.any()):
+                # Respawned particles are placed against those staying on screen
+                staying = np.concatenate([circles_register[~circles_respawned, :3], blobs_register[~blobs_respawned, :3]])
+                grid.build(*staying.T)
+            respawned = np.flatnonzero(circles_respawned)
+            if len(respawned):
+                circles_register[respawned] = self.circles_creator(taille, len(respawned))
+                if grid is not None:
+                    self.place(circles_register, respawned, taille, grid)
+                circle_ids[respawned] = np.arange(next_id, next_id + len(respawned))
+                next_id += len(respawned)
+                f2.write("".join(f"{nf} " for nf in circles_register[respawned, 3]))
+            respawned = np.flatnonzero(blobs_respawned)
+            if len(respawned):
+                blobs_register[respawned] = self.blobs_creator(taille, len(respawned))
+                if grid is not None:
+                    self.place(blobs_register, respawned, taille, grid)
+                blob_ids[respawned] = np.arange(next_id, next_id + len(respawned))
+                next_id += len(respawned)
+            blob_polygons = [self.blob_polygon(*blobs_register[i, :3]) for i in range(self.n_blobs)]
+            checkpoint = None
+            if self.checkpoint_interval and (count + 1) % self.checkpoint_interval == 0 and count + 1 < self.n_pic:
+                checkpoint = {
+                    "frame": count, "circles_register": circles_register.copy(), "blobs_register": blobs_register.copy(),
+                    "circle_ids": circle_ids.copy(), "blob_ids": blob_ids.copy(), "next_id": next_id,
+                    "placements": (self.placements, self.placement_attempts, self.placement_failures),
+                    "rng": self.rng.bit_generator.state, "properties_offset": f2.tell(),
+                }
+            yield FrameState(circles_register.copy(), blobs_register.copy(), blob_polygons,
+                             circle_ids.copy(), blob_ids.copy(), count, checkpoint)
+
+    def blurred_background(self):
+        """Return the blurred static background, computed once"""
+        if self._blurred_background is None:
+            self._blurred_background = cv2.GaussianBlur(np.ascontiguousarray(self.background(0)),
+                                                         self.blur_kernel, cv2.BORDER_DEFAULT)
+        return self._blurred_background
+
+    @staticmethod
+    def merge_rects(rects):
+        """Merge overlapping (x0, y0, x1, y1) boxes whose bounding box is no larger than the two boxes"""
+        area = lambda box: (box[2] - box[0]) * (box[3] - box[1])
+        merged = True
+        while merged:
+            merged = False
+            boxes = []
+            for rect in rects:
+                for i, box in enumerate(boxes):
+                    if rect[0] < box[2] and box[0] < rect[2] and rect[1] < box[3] and box[1] < rect[3]:
+                        union = (min(rect[0], box[0]), min(rect[1], box[1]), max(rect[2], box[2]), max(rect[3], box[3]))
+                        if area(union) <= area(rect) + area(box):
+                            boxes[i] = union
+                            merged = True
+                            break
+                else:
+                    boxes.append(rect)
+            rects = boxes
+        return rects
+
+    @staticmethod
+    def object_extents(state):
+        """Return the centres and half-sizes of the drawn boxes of the circles, then the blobs, of a frame"""
+        circles, blobs = state.circles_register, state.blobs_register
+        radius = circles[:, 2].astype(int)
+        # Half-size of the circle sprites (as in render_circle_sprite), then of the blob disks
+        half = np.concatenate([radius + np.maximum(1, (2 * radius / (circles[:, 3].astype(int) + 1) / 2).astype(int)) + 2,
+                               blobs[:, 2].astype(int) + 1])
+        x = np.concatenate([circles[:, 0], blobs[:, 0]]).astype(int)
+        y = np.concatenate([circles[:, 1], blobs[:, 1]]).astype(int)
+        return x, y, half
+
+    def dirty_rects(self, state, shape):
+        """Return the merged boxes of the pixels whose blurred value the objects of a frame can change"""
+        x, y, half = self.object_extents(state)
+        reach = half + (self.blur_kernel[0] - 1) // 2
+        x0, x1 = np.clip(x - reach, 0, shape[1]), np.clip(x + reach + 1, 0, shape[1])
+        y0, y1 = np.clip(y - reach, 0, shape[0]), np.clip(y + reach + 1, 0, shape[0])
+        visible = (x0 < x1) & (y0 < y1)
+        return self.merge_rects(list(zip(x0[visible].tolist(), y0[visible].tolist(),
+                                         x1[visible].tolist(), y1[visible].tolist())))
+
+    def blur(self, image, state):
+        """Gaussian-blur a frame, only around its objects in dirty_blur mode with a static background
+
+        Away from the objects the frame equals the background, so its blurred value is taken
+        from the blurred background; each dirty box is blurred from a crop padded by the kernel
+        radius, which gives the same pixels as blurring the full frame (so boxes left overlapping
+        by merge_rects write identical values).
+        """
+        static = self.background_source is None or len(self.background_source) <= 1
+        if not (self.dirty_blur and static):
+            return cv2.GaussianBlur(image, self.blur_kernel, cv2.BORDER_DEFAULT)
+        height, width = image.shape[:2]
+        k = (self.blur_kernel[0] - 1) // 2
+        crops = [(x0, y0, x1, y1, max(x0 - k, 0), max(y0 - k, 0), min(x1 + k, width), min(y1 + k, height))
+                 for x0, y0, x1, y1 in self.dirty_rects(state, image.shape)]
+        # Blurring a crop costs about its area plus a border term growing with the kernel, so once
+        # the crops add up to most of the frame a single full-frame blur is faster
+        cost = sum((cx1 - cx0) * (cy1 - cy0) + 16 * k * (cx1 - cx0 + cy1 - cy0) for *_, cx0, cy0, cx1, cy1 in crops)
+        if cost > 0.8 * width * height:
+            return cv2.GaussianBlur(image, self.blur_kernel, cv2.BORDER_DEFAULT)
+        blurred = self.blurred_background().copy()
+        for x0, y0, x1, y1, cx0, cy0, cx1, cy1 in crops:
+            crop = cv2.GaussianBlur(image[cy0:cy1, cx0:cx1], self.blur_kernel, cv2.BORDER_DEFAULT)
+            blurred[y0:y1, x0:x1] = crop[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0]
+        return blurred
+
+    def draw_objects(self, image, state, x0=0, y0=0):
+        """Draw the circles and blobs of a frame into image, the region of the frame whose top-left pixel is (x0, y0)"""
+        circles_register, blobs_register, blob_polygons = state[:3]
+        x, y, half = self.object_extents(state)
+        near = (x + half >= x0) & (x - half < x0 + image.shape[1]) & (y + half >= y0) & (y - half < y0 + image.shape[0])
+        with self.timer.stage("circles"):
+            for i in np.flatnonzero(near[:len(circles_register)]):
+                plx, ply, radius, nf, IB, color = circles_register[i]
+                self.draw_circle(image, int(plx) - x0, int(ply) - y0, radius, nf, color)
+        with self.timer.stage("blobs"):
+            for i in np.flatnonzero(near[len(circles_register):]):
+                plx, ply, radius, color_b, color_g, color_r, IB = blobs_register[i]
+                plx, ply = int(plx) - x0, int(ply) - y0
+                color = (int(color_b), int(color_g), int(color_r))
+                cv2.circle(image, (plx, ply), int(radius), self.pixel(color), -1)
+                self.draw_blob_gradient(image, plx, ply, radius, color)
+                self.fill_polygon(image, blob_polygons[i], self.pixel((250, 250, 250)), x0, y0)
+
+    def fill_polygon(self, image, points, value, x0=0, y0=0):
+        """Fill a polygon given in frame coordinates into image, the frame region whose top-left pixel is (x0, y0)
+
+        cv2.fillPoly clips polygon edges against the borders of the image it draws into, which
+        changes the rounding, so the polygon is filled in a patch of its bounding box cut to the
+        frame: it is clipped by the frame borders only, as when drawn into the full frame.
+        """
+        width, height = self.background_resolution
+        px0, py0 = max(int(points[..., 0].min()), 0), max(int(points[..., 1].min()), 0)
+        px1, py1 = min(int(points[..., 0].max()) + 1, width), min(int(points[..., 1].max()) + 1, height)
+        if px0 >= px1 or py0 >= py1:
+            return
+        mask = np.zeros((py1 - py0, px1 - px0), dtype=np.uint8)
+        cv2.fillPoly(mask, [points - np.int32((px0, py0))], 255)
+        box = self.clip_box(image, px0 - x0, py0 - y0, mask.shape)
+        if box is None:
+            return
+        region, stamp = box
+        image[region][mask[stamp].astype(bool)] = value
+
+    def tiles(self):
+        """Return the frame regions (x0, y0, x1, y1) rendered one at a time, in output row order
+
+        Tiles are bands across the frame that become bands of output rows after rotation (rows,
+        or columns when the frame is rotated by 90 degrees), as thick as tile_memory_mb allows
+        for the tile, its blur margins and its blurred and rotated copies.
+        """
+        width, height = self.background_resolution
+        columns = self.apply_rotation and self.rotation_angle in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE)
+        length, line = (width, height) if columns else (height, width)
+        line_bytes = line * (1 if self.grayscale else 3) * np.dtype(self.dtype).itemsize
+        k = (self.blur_kernel[0] - 1) // 2 if self.apply_blur else 0
+        size = int(self.tile_memory_mb * 2 ** 20) // (3 * line_bytes) - 2 * k
+        if size < 1:
+            raise ValueError(f"tile_memory_mb={self.tile_memory_mb} is too small for {width}x{height} frames, "
+                             f"at least {3 * (1 + 2 * k) * line_bytes / 2 ** 20:.2f} MB are needed")
+        bands = [(start, min(start + size, length)) for start in range(0, length, size)]
+        if self.apply_rotation and self.rotation_angle in (cv2.ROTATE_90_COUNTERCLOCKWISE, cv2.ROTATE_180):
+            bands.reverse()
+        return [(start, 0, stop, height) if columns else (0, start, width, stop) for start, stop in bands]
+
+    def render_tile(self, state, x0, y0, x1, y1):
+        """Render the region [x0, x1) x [y0, y1) of a frame, blurred and rotated as in the full frame
+
+        The region is drawn with a margin of the blur radius, so blurring it gives the same pixels
+        as blurring the full frame.
+        """
+        width, height = self.background_resolution
+        k = (self.blur_kernel[0] - 1) // 2 if self.apply_blur else 0
+        mx0, my0, mx1, my1 = max(x0 - k, 0), max(y0 - k, 0), min(x1 + k, width), min(y1 + k, height)
+        with self.timer.stage("background"):
+            image = np.array(self.background(state.frame)[my0:my1, mx0:mx1])
+        self.draw_objects(image, state, mx0, my0)
+        if self.apply_blur:
+            with self.timer.stage("blur"):
+                image = cv2.GaussianBlur(image, self.blur_kernel, cv2.BORDER_DEFAULT)[y0 - my0:y1 - my0, x0 - mx0:x1 - mx0]
+        if self.apply_rotation:
+            with self.timer.stage("rotate"):
+                image = cv2.rotate(image, self.rotation_angle)
+        return image
+
+    def render_bands(self, state):
+        """Yield the rendered frame as consecutive bands of output rows, one per tile"""
+        row = 0
+        for region in self.tiles():
+            band = self.render_tile(state, *region)
+            if self.sensor_noise is not None:
+                with self.timer.stage("noise"):
+                    self.sensor_noise.apply(band, state.frame, row)
+            row += len(band)
+            yield band
+
+    def render_frame(self, state):
+        """Rasterize one frame from its simulated state, then blur and rotate it"""
+        if self.tile_memory_mb is not None:
+            image = np.empty(self.output_shape(), dtype=self.dtype)
+            row = 0
+            for band in self.render_bands(state):
+                image[row:row + len(band)] = band
+                row += len(band)
+            return image
+        with self.timer.stage("background"):
+            image = self.frame_buffer(state.frame)
+        self.draw_objects(image, state)
+        if self.apply_blur:
+            with self.timer.stage("blur"):
+                image = self.blur(image, state)
+        if self.apply_rotation:
+            with self.timer.stage("rotate"):
+                image = cv2.rotate(image, self.rotation_angle)
+        if image is self._frame_buffer:
+            image = image.copy()
+        if self.sensor_noise is not None:
+            with self.timer.stage("noise"):
+                self.sensor_noise.apply(image, state.frame)
+        return image
+
+    def render_frames(self, states, encoder=None, bands=False):
+        """Yield (state, frame) in order, rendering on a process pool when n_workers > 1
+
+        With an encoder (a PngSequenceWriter) the workers also encode the frames and the
+        encoded bytes are yielded instead of the image. With bands (tiled, single process) the
+        frame is yielded as the lazy render_bands iterator instead. On the pool, the time spent
+        waiting for each frame is profiled as a single "render" stage.
+        """
+        if self.n_workers <= 1:
+            for state in states:
+                if bands:
+                    yield state, self.render_bands(state)
+                    continue
+                image = self.render_frame(state)
+                yield state, encoder.encode(image) if encoder is not None else image
+            return
+        # Simulate every frame up front, then keep at most max_pending frames in flight so the
+        # in-order reassembly buffer stays bounded however far ahead the workers get
+        states = list(states)
+        if self.background_source is not None:
+            self.background_source.prefetch(self.n_pic)
+        max_pending = self.max_pending_frames or 2 * self.n_workers
+        pending = deque()
+        # Spawned, not forked: the GUI runs jobs on threads, and forking a threaded process can
+        # copy locks another thread holds into the workers
+        with ProcessPoolExecutor(self.n_workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_render_worker, initargs=(self, encoder)) as pool:
+            for state in states:
+                pending.append((state, pool.submit(_render_worker_frame, state)))
+                if len(pending) >= max_pending:
+                    state, future = pending.popleft()
+                    with self.timer.stage("render"):
+                        image = future.result()
+                    yield state, image
+            while pending:
+                state, future = pending.popleft()
+                with self.timer.stage("render"):
+                    image = future.result()
+                yield state, image
+
+    def render_preview(self, frames, scale, background_source=None):
+        """Render the given frame indices at a reduced scale, for a quick look at the scene
+
+        The particles are simulated at full resolution, so the preview shows the scene of a run
+        with the same seed, then drawn with positions, radii and blur scaled down. A
+        background_source, if given, must already be at the scaled resolution.
+        """
+        wanted = set(frames)
+        states = []
+        for state in self.simulate_frames(self.background_resolution, io.StringIO()):
+            if state.frame in wanted:
+                states.append(state)
+                if len(states) == len(wanted):
+                    break
+        preview = copy.copy(self)
+        preview.background_resolution = tuple(max(1, round(size * scale)) for size in self.background_resolution)
+        preview.background_source = background_source
+        preview._background_missing = background_source is None
+        preview._frame_buffer = None
+        preview.circle_sprites = SpriteCache(self.circle_sprites.max_size)
+        preview._blob_stamps = {}
+        preview.timer = StageTimer(False)
+        preview.sensor_noise = copy.copy(self.sensor_noise)
+        blur_radius = round(self.blur_radius * scale)
+        preview.apply_blur = self.apply_blur and blur_radius > 0
+        preview.blur_kernel = (blur_radius * 2 + 1, blur_radius * 2 + 1)
+        preview._blurred_background = None
+        images = []
+        for state in states:
+            circles, blobs = state.circles_register.copy(), state.blobs_register.copy()
+            for register in (circles, blobs):
+                register[:, :3] = np.round(register[:, :3] * scale)
+                register[:, 2] = np.maximum(register[:, 2], 1)
+            polygons = [np.round(polygon * scale).astype(np.int32) for polygon in state.blob_polygons]
+            images.append(preview.render_frame(state._replace(circles_register=circles, blobs_register=blobs,
+                                                              blob_polygons=polygons)))
+        return images
+
+    def ground_truth_path(self, ext):
+        """Return the path of the per-object ground truth file for a run name"""
+        return os.path.join(self.output_video_path, f"ground_truth_{ext}.{self.ground_truth_format}")
+
+    def output_coordinates(self, x, y, taille):
+        """Map drawing coordinates to the coordinates of the (possibly rotated) output frame"""
+        if self.apply_rotation and self.rotation_angle == cv2.ROTATE_90_CLOCKWISE:
+            return taille[1] - 1 - y, x
+        if self.apply_rotation and self.rotation_angle == cv2.ROTATE_90_COUNTERCLOCKWISE:
+            return y, taille[0] - 1 - x
+        if self.apply_rotation and self.rotation_angle == cv2.ROTATE_180:
+            return taille[0] - 1 - x, taille[1] - 1 - y
+        return x, y
+
+    def frame_ground_truth(self, count, state, taille):
+        """Return the IPI_GROUND_TRUTH_COLUMNS of a frame as arrays, one entry per circle then per blob"""
+        circles, blobs = state.circles_register, state.blobs_register
+        x, y = self.output_coordinates(np.concatenate([circles[:, 0], blobs[:, 0]]).astype(int),
+                                       np.concatenate([circles[:, 1], blobs[:, 1]]).astype(int), taille)
+        return {
+            "frame": np.full(len(circles) + len(blobs), count),
+            "object_id": np.concatenate([state.circle_ids, state.blob_ids]),
+            "type": np.array(["circle"] * len(circles) + ["blob"] * len(blobs), dtype="U6"),
+            "x": x,
+            "y": y,
+            "radius": np.concatenate([circles[:, 2], blobs[:, 2]]).astype(int),
+            "fringe_count": np.concatenate([circles[:, 3], np.zeros(len(blobs))]).astype(int),
+        }
+
+    def write_ground_truth(self, ground_truth, count, state, taille):
+        """Record the position, radius and fringe count of every circle and blob of a frame"""
+        ground_truth.append(**self.frame_ground_truth(count, state, taille))
+
+    def iter_frames(self, prefetch=0):
+        """Yield (frame index, frame, ground truth columns) for every frame, without writing anything
+
+        Frames are rendered lazily (on the process pool when n_workers > 1) and the ground truth
+        is the dict returned by frame_ground_truth. With prefetch > 0 a background thread renders
+        up to prefetch frames ahead of the consumer.
+        """
+        frames = self._iter_frames()
+        return prefetch_iter(frames, prefetch) if prefetch > 0 else frames
+
+    def _iter_frames(self):
+        self.open_background()
+        try:
+            image = self.background()
+            taille = (image.shape[1], image.shape[0])
+            for state, image in self.render_frames(self.simulate_frames(taille, io.StringIO())):
+                yield state.frame, image, self.frame_ground_truth(state.frame, state, taille)
+        finally:
+            self.close_background()
+
+    def checkpoint_path(self, ext):
+        """Return the path of the checkpoint of a run name"""
+        return os.path.join(self.output_video_path, f"checkpoint_{ext}.pkl")
+
+    def checkpoint_signature(self):
+        """Return the parameters a checkpoint must have been saved with to be resumed"""
+        return {
+            "n_pic": self.n_pic, "resolution": self.background_resolution, "n_circles": self.n_circles,
+            "n_blobs": self.n_blobs, "checkpoint_interval": self.checkpoint_interval,
+            "output_format": self.output_format, "stream_video": self.stream_video, "codec": self.video_codec(),
+            "apply_rotation": self.apply_rotation, "ground_truth_format": self.ground_truth_format,
+            "sensor_noise": (self.gain, self.shot_noise, self.read_noise, self.fixed_pattern_noise),
+        }
+
+    def save_checkpoint(self, ext, state, writer, f2, f, ground_truth):
+        """Save the checkpoint of a state once its frame and ground truth are written, flushing the outputs"""
+        if hasattr(writer, "flush"):
+            writer.flush()
+        f2.flush()
+        f.flush()
+        save_checkpoint(self.checkpoint_path(ext), {
+            "signature": self.checkpoint_signature(), "seed": self.seed, "simulation": state.checkpoint,
+            "text_offset": f.tell(), "ground_truth_offset": ground_truth.tell(),
+        })
+
+    def create_images(self, ext=None, progress=None, resume=False):
+        """Generate sequence of images with circles and blobs, named ext (random name by default)
+
+        progress, if given, is called as progress(frame, n_frames) after each frame is written;
+        an exception raised from it stops the generation after closing the outputs. With
+        checkpoint_interval a checkpoint is saved every checkpoint_interval frames, and resume
+        continues the run named ext from its last checkpoint, giving the same outputs as an
+        uninterrupted run. Resuming without checkpoint_interval, or without a checkpoint once
+        outputs of the run exist, is an error.
+        """
+        checkpoint = None
+        if resume:
+            if not ext:
+                raise ValueError("Resuming needs the name of the run")
+            if not self.checkpoint_interval:
+                raise ValueError("Resuming needs the checkpoint_interval of the interrupted run")
+            checkpoint = load_checkpoint(self.checkpoint_path(ext), self.checkpoint_signature())
+            if checkpoint is None:
+                start_without_checkpoint(self.checkpoint_path(ext), [
+                    self.video_file_path(ext), self.ground_truth_path(ext),
+                    os.path.join(self.output_video_path, f"circles_properties_synth_{ext}.txt"),
+                    os.path.join(self.output_video_path, f"circles_properties_synth_noduplicate_{ext}.txt"),
+                    os.path.join(self.save_path, "creator000.png")])
+        if checkpoint is not None:
+            self.seed = checkpoint["seed"]
+            self.rng = np.random.default_rng(self.seed)
+            self.sensor_noise = make_sensor_noise(self.seed, self.gain, self.shot_noise, self.read_noise,
+                                                  self.fixed_pattern_noise)
+            start = checkpoint["simulation"]["frame"] + 1
+            print(f"Resuming image generation at frame {start} (seed {self.seed})...")
+        else:
+            start = 0
+            print(f"Starting image generation (seed {self.seed})...")
+        ext = ext or names.get_first_name(gender='male')
+        self.timer = StageTimer(self.profile)
+        self.open_background()
+        image = self.background()
         taille = (image.shape[1], image.shape[0])
-        circles_register = np.zeros([self.n_circles, 6])
-        blobs_register = np.zeros([self.n_blobs, 7])
-        with open(os.path.join(self.output_video_path, f"circles_properties_synth_noduplicate_{ext}.txt"), "w") as f2:
-            for i in range(self.n_circles):
-                circles_register[i] = np.array(self.unique_circle_creator(taille))
-                f2.write(f"{circles_register[i, 3]} ")
-            for i in range(self.n_blobs):
-                blobs_register[i] = np.array(self.unique_blob_creator(taille))
-            for count in tqdm(range(self.n_pic), desc="Generating images"):
-                image = self.create_background()
-                for i in range(self.n_circles):
-                    circles_register[i, 0] = int(circles_register[i, 0] + self.vitx * self.dt * circles_register[i, 4] * 10 * np.random.rand())
-                    circles_register[i, 1] = int(circles_register[i, 1] + self.vity * self.dt * circles_register[i, 4] * 10 * np.random.rand())
-                    if (circles_register[i, 0] > taille[0] or circles_register[i, 0] < 0 or
-                        circles_register[i, 1] > taille[1] or circles_register[i, 1] < 0 or
-                        np.random.rand() < 0.05):
-                        circles_register[i] = np.array(self.unique_circle_creator(taille))
-                        f2.write(f"{circles_register[i, 3]} ")
-                for i in range(self.n_blobs):
-                    blobs_register[i, 0] = int(blobs_register[i, 0] + self.vitx * self.dt * blobs_register[i, 6] * 10 * np.random.rand())
-                    blobs_register[i, 1] = int(blobs_register[i, 1] + self.vity * self.dt * blobs_register[i, 6] * 10 * np.random.rand())
-                    if (blobs_register[i, 0] > taille[0] or blobs_register[i, 0] < 0 or
-                        blobs_register[i, 1] > taille[1] or blobs_register[i, 1] < 0 or
-                        np.random.rand() < 0.05):
-                        blobs_register[i] = np.array(self.unique_blob_creator(taille))
-                for i in range(self.n_circles):
-                    image = cv2.circle(image, (int(circles_register[i, 0]), int(circles_register[i, 1])), int(circles_register[i, 2]),
-                                       (int(circles_register[i, 5]), 100, 0), -1)
-                    dl = 2 * circles_register[i, 2] / (circles_register[i, 3] + 1)
-                    for j in range(1, int(circles_register[i, 3]) + 1):
-                        d0 = abs(circles_register[i, 2] - int(j * dl))
-                        dy = int(np.sqrt(int(circles_register[i, 2]) ** 2 - d0 ** 2)) - 2
-                        x, y = int(circles_register[i, 0]), int(circles_register[i, 1])
-                        dx = int(circles_register[i, 2]) - int(j * dl)
-                        start_point, end_point = (x + dx, y - dy), (x + dx, y + dy)
-                        color, th = (15, 5, 5), max(1, int(dl / 2))
-                        image = cv2.line(image, start_point, end_point, color, th)
-                for i in range(self.n_blobs):
-                    plx, ply, radius, color_b, color_g, color_r, IB = blobs_register[i]
-                    color = (int(color_b), int(color_g), int(color_r))
-                    cv2.circle(image, (int(plx), int(ply)), int(radius), color, -1)
-                    gradient = np.linspace(0, 1, int(radius))
-                    colors = np.zeros((int(radius), 3), dtype=int)
-                    colors[:, 0] = (color[0] * (1 - gradient)).astype(int)
-                    colors[:, 1] = (color[1] * (1 - gradient)).astype(int)
-                    colors[:, 2] = (color[2] * gradient).astype(int)
-                    for x in range(int(plx) - int(radius), int(plx) + int(radius)):
-                        for y in range(int(ply) - int(radius), int(ply) + int(radius)):
-                            if ((x - plx) ** 2 + (y - ply) ** 2) <= radius ** 2:
-                                distance_from_center = np.sqrt((x - plx) ** 2 + (y - ply) ** 2)
-                                color_index = int(radius) - int(distance_from_center)
-                                if color_index < 0:
-                                    color_index = 0
-                                elif color_index >= int(radius):
-                                    color_index = int(radius) - 1
-                                image[y, x] = colors[color_index]
-                    num_points = 10
-                    points = []
-                    while len(points) < num_points:
-                        x = random.randint(int(plx) - int(radius), int(plx) + int(radius))
-                        y = random.randint(int(ply) - int(radius), int(ply) + int(radius))
-                        if ((x - plx) ** 2 + (y - ply) ** 2) <= radius ** 2:
-                            points.append((x, y))
-                    pts = np.array(points, np.int32)
-                    pts = pts.reshape((-1, 1, 2))
-                    cv2.fillPoly(image, [pts], (250, 250, 250))
-                if self.apply_blur:
-                    image = cv2.GaussianBlur(image, self.blur_kernel, cv2.BORDER_DEFAULT)
-                if self.apply_rotation:
-                    image = cv2.rotate(image, self.rotation_angle)
-                if self.save:
-                    filename = os.path.join(self.save_path, f'creator{str(count).zfill(3)}.png')
-                    cv2.imwrite(filename, image, [cv2.IMWRITE_PNG_COMPRESSION, 3])
-                    with open(os.path.join(self.output_video_path, f"circles_properties_synth_{ext}.txt"), "a") as f:
-                        f.write(" ".join(map(str, circles_register[:, 3])) + "\n")
+        writer = self.open_frame_writer(ext, start) if self.save else None
+        # PNG frames are encoded by the render workers, streamed video is encoded by the writer
+        encoder = writer if self.n_workers > 1 and isinstance(writer, PngSequenceWriter) else None
+        # Tiled frames are handed band by band to the writers that take them, never assembled
+        bands = self.tile_memory_mb is not None and self.n_workers <= 1 and hasattr(writer, "write_bands")
+        simulation = checkpoint["simulation"] if checkpoint else None
+        ground_truth = GroundTruthWriter(self.ground_truth_path(ext), IPI_GROUND_TRUTH_COLUMNS,
+                                         offset=checkpoint["ground_truth_offset"] if checkpoint else None) if self.save else None
+        try:
+            with open_text_output(os.path.join(self.output_video_path, f"circles_properties_synth_noduplicate_{ext}.txt"),
+                                  simulation["properties_offset"] if checkpoint else None) as f2, \
+                    open_text_output(os.path.join(self.output_video_path, f"circles_properties_synth_{ext}.txt"),
+                                     checkpoint["text_offset"] if checkpoint else None) as f:
+                states = self.timer.timed_iter("simulation", self.simulate_frames(taille, f2, simulation))
+                for count, (state, image) in enumerate(tqdm(self.render_frames(states, encoder, bands), total=self.n_pic,
+                                                            initial=start, desc="Generating images"), start):
+                    if self.save:
+                        with self.timer.stage("write"):
+                            if encoder is not None:
+                                writer.write_encoded(image)
+                            elif bands:
+                                writer.write_bands(image, self.output_shape(), self.dtype)
+                            else:
+                                writer.write(image)
+                        with self.timer.stage("ground_truth"):
+                            f.write(" ".join(map(str, state.circles_register[:, 3])) + "\n")
+                            self.write_ground_truth(ground_truth, count, state, taille)
+                        if state.checkpoint is not None:
+                            self.save_checkpoint(ext, state, writer, f2, f, ground_truth)
+                    self.timer.end_frame()
+                    if progress is not None:
+                        progress(count + 1, self.n_pic)
+        finally:
+            if ground_truth is not None:
+                ground_truth.close()
+            if writer is not None:
+                writer.close()
+            self.close_background()
+        remove_checkpoint(self.checkpoint_path(ext))
         print("Image generation completed.")
+        if self.circle_sprites.hits or self.circle_sprites.misses:
+            print(f"Circle sprite cache: {self.circle_sprites.hits} hits, {self.circle_sprites.misses} misses.")
+        if self.placements:
+            print(f"Overlap control: {self.placements} particles placed in {self.placement_attempts} attempts, "
+                  f"{self.placement_failures} without meeting the constraint.")
+        if self.profile:
+            print_report(self.timer.write_json(os.path.join(self.output_video_path, f"profile_{ext}.json")))
         return ext
 
     def make_video_file(self, ext):
-        """Create video from generated image frames"""
+        """Create video from generated image frames, in concurrently encoded segments with segment_frames"""
         print("Starting video creation...")
-        os.system(
-            f'ffmpeg -framerate {self.fps} -i {os.path.join(self.save_path, "creator%03d.png")} '
-            f'-pattern_type glob -c:v libx264 -pix_fmt yuv420p {os.path.join(self.output_video_path, f"Vid_{ext}.avi")} -y')
+        codec, pix_fmt = self.video_codec()
+        encode_image_sequence(os.path.join(self.save_path, "creator%03d.png"), self.video_file_path(ext), self.fps,
+                              self.n_pic, codec, pix_fmt, self.quality, self.segment_frames, self.encode_workers)
         print("Video creation completed.")
         print("Cleaning up temporary files...")
-        for f in os.listdir(self.save_path):
-            if f.endswith('.png'):
-                os.remove(os.path.join(self.save_path, f))
+        # Only the frames of this run: save_path may hold other files or the frames of another job
+        for count in range(self.n_pic):
+            frame_path = os.path.join(self.save_path, f"creator{count:03d}.png")
+            if os.path.exists(frame_path):
+                os.remove(frame_path)
         print("Cleanup completed.")
 
 def main():
@@ -194,6 +954,33 @@ def main():
     parser.add_argument("--background_image_path", type=str, default=os.path.join(script_dir, "AVG_bg.tif"))
     parser.add_argument("--save_path", type=str, default=os.path.join(script_dir, "Images"))
     parser.add_argument("--output_video_path", type=str, default=script_dir)
+    parser.add_argument("--sprite_cache_size", type=int, default=256)
+    parser.add_argument("--stream_video", type=int, default=0)
+    parser.add_argument("--n_workers", type=int, default=1)
+    parser.add_argument("--ground_truth_format", type=str, default="csv", choices=["csv", "npz", "parquet"])
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--profile", type=int, default=0)
+    parser.add_argument("--dirty_blur", type=int, default=0)
+    parser.add_argument("--grayscale", type=int, default=0)
+    parser.add_argument("--bit_depth", type=int, default=8, choices=[8, 16])
+    parser.add_argument("--min_separation", type=float, default=None)
+    parser.add_argument("--max_overlap", type=float, default=None)
+    parser.add_argument("--max_placement_attempts", type=int, default=100)
+    parser.add_argument("--codec", type=str, default=None, choices=list(VIDEO_CODECS))
+    parser.add_argument("--quality", type=int, default=None)
+    parser.add_argument("--segment_frames", type=int, default=0)
+    parser.add_argument("--encode_workers", type=int, default=None)
+    parser.add_argument("--output_format", type=str, default="video", choices=list(OUTPUT_FORMATS))
+    parser.add_argument("--width", type=int, default=2 * 1024)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--tile_memory_mb", type=float, default=None)
+    parser.add_argument("--checkpoint_interval", type=int, default=0)
+    parser.add_argument("--name", type=str, default=None)
+    parser.add_argument("--resume", type=int, default=0)
+    parser.add_argument("--gain", type=float, default=1.0)
+    parser.add_argument("--shot_noise", type=float, default=0.0)
+    parser.add_argument("--read_noise", type=float, default=0.0)
+    parser.add_argument("--fixed_pattern_noise", type=float, default=0.0)
     args = parser.parse_args()
 
     creator = CircleImageCreator(
@@ -211,10 +998,34 @@ def main():
         use_background_image=bool(args.use_background_image),
         background_image_path=args.background_image_path,
         save_path=args.save_path,
-        output_video_path=args.output_video_path
+        output_video_path=args.output_video_path,
+        sprite_cache_size=args.sprite_cache_size,
+        stream_video=bool(args.stream_video),
+        n_workers=args.n_workers,
+        ground_truth_format=args.ground_truth_format,
+        seed=args.seed,
+        profile=bool(args.profile),
+        dirty_blur=bool(args.dirty_blur),
+        grayscale=bool(args.grayscale),
+        bit_depth=args.bit_depth,
+        min_separation=args.min_separation,
+        max_overlap=args.max_overlap,
+        max_placement_attempts=args.max_placement_attempts,
+        codec=args.codec,
+        quality=args.quality,
+        segment_frames=args.segment_frames,
+        encode_workers=args.encode_workers,
+        output_format=args.output_format,
+        resolution=(args.width, args.height),
+        tile_memory_mb=args.tile_memory_mb,
+        checkpoint_interval=args.checkpoint_interval,
+        gain=args.gain,
+        shot_noise=args.shot_noise,
+        read_noise=args.read_noise,
+        fixed_pattern_noise=args.fixed_pattern_noise
     )
-    ext = creator.create_images()
-    if creator.make_video:
+    ext = creator.create_images(args.name, resume=bool(args.resume))
+    if creator.make_video and not creator.stream_video:
         creator.make_video_file(ext)
 
 if __name__ == '__main__':
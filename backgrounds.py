@@ -0,0 +1,151 @@
+import os
+import tempfile
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".tif", ".tiff", ".png", ".jpg", ".jpeg", ".bmp")
+
+
+class BackgroundSource:
+    """Backgrounds read from a single image, a directory of images or a video
+
+    Frame k uses background k modulo the number of backgrounds. A single image is decoded once
+    and kept in memory. Image sequences and videos are decoded lazily, the first time each
+    background is needed, into a memory-mapped cache file so they are not held in RAM. Every
+    background is checked against resolution (width, height) and resized if it differs, with a
+    warning unless warn_resize is False, then converted to single-channel if grayscale and to
+    dtype (uint8 or uint16; 16-bit images keep their full depth when dtype is uint16).
+    """
+    def __init__(self, path, resolution, warn_resize=True, grayscale=False, dtype=np.uint8):
+        self.path = path
+        self.resolution = tuple(resolution)
+        self.shape = (resolution[1], resolution[0]) if grayscale else (resolution[1], resolution[0], 3)
+        self.dtype = np.dtype(dtype)
+        self.warn_resize = warn_resize
+        self._image = None
+        self._files = None
+        self._capture = None
+        self._cache_path = None
+        self._cache = None
+        self._decoded = None
+        self._warned = False
+        if os.path.isdir(path):
+            self._files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+            self.count = len(self._files)
+        elif os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+            self._image = self._read_image(path)
+            self.count = 0 if self._image is None else 1
+        else:
+            self._capture = cv2.VideoCapture(path)
+            self.count = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT)) if self._capture.isOpened() else 0
+        if self.count == 1 and self._image is None:
+            if self._files is not None:
+                self._image = self._read_image(self._files[0])
+            else:
+                ok, image = self._capture.read()
+                self._image = self._check(image, path) if ok else None
+            self.count = 0 if self._image is None else 1
+        if self.count > 1:
+            fd, self._cache_path = tempfile.mkstemp(prefix="backgrounds_", suffix=".npy")
+            os.close(fd)
+            self._cache = np.lib.format.open_memmap(self._cache_path, mode="w+", dtype=self.dtype,
+                                                    shape=(self.count,) + self.shape)
+            self._decoded = np.zeros(self.count, dtype=bool)
+
+    def __len__(self):
+        return self.count
+
+    def _check(self, image, name):
+        """Resize an image to the expected resolution and convert it to the expected channels and dtype"""
+        if image.shape[:2] != self.shape[:2]:
+            if self.warn_resize and not self._warned:
+                print(f"Background {name} is {image.shape[1]}x{image.shape[0]}, "
+                      f"resizing to {self.resolution[0]}x{self.resolution[1]}.")
+                self._warned = True
+            image = cv2.resize(image, self.resolution, interpolation=cv2.INTER_AREA)
+        if image.ndim == 3 and len(self.shape) == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if image.dtype != self.dtype:
+            if image.dtype == np.uint8 and self.dtype == np.uint16:
+                image = image.astype(np.uint16) * 257
+            else:
+                image = np.clip(image, 0, np.iinfo(self.dtype).max).astype(self.dtype)
+        return image
+
+    def _read_image(self, path):
+        flags = cv2.IMREAD_GRAYSCALE if len(self.shape) == 2 else cv2.IMREAD_COLOR
+        if self.dtype == np.uint16:
+            flags |= cv2.IMREAD_ANYDEPTH
+        image = cv2.imread(path, flags)
+        if image is None:
+            return None
+        return self._check(image, path)
+
+    def _decode(self, index):
+        if self._files is not None:
+            image = self._read_image(self._files[index])
+            if image is None:
+                raise ValueError(f"Could not read background image {self._files[index]}")
+            self._cache[index] = image
+            self._decoded[index] = True
+            return
+        # Videos decode sequentially, up to the requested frame
+        next_index = int(np.argmin(self._decoded)) if not self._decoded.all() else self.count
+        while next_index <= index:
+            ok, image = self._capture.read()
+            if not ok:
+                # The container reported more frames than it holds: wrap over the decoded ones
+                self.count = next_index
+                return
+            self._cache[next_index] = self._check(image, self.path)
+            self._decoded[next_index] = True
+            next_index += 1
+
+    def get(self, index):
+        """Return the (read-only) background of frame index"""
+        if self._image is not None:
+            return self._image
+        index %= self.count
+        if not self._decoded[index]:
+            self._decode(index)
+            index %= self.count
+        return self._cache[index]
+
+    def prefetch(self, n_frames):
+        """Decode every background used by the first n_frames frames"""
+        if self._cache is not None:
+            for index in range(min(n_frames, self.count)):
+                self.get(index)
+
+    def __getstate__(self):
+        # Worker processes reopen the cache file read-only instead of receiving a copy
+        state = self.__dict__.copy()
+        state["_cache"] = None
+        state["_capture"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._cache_path is not None:
+            self._cache = np.load(self._cache_path, mmap_mode="r")
+
+    def close(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+        if self._cache_path is not None:
+            self._cache = None
+            if os.path.exists(self._cache_path):
+                os.remove(self._cache_path)
+            self._cache_path = None
+
+
+def open_background_source(path, resolution, warn_resize=True, grayscale=False, dtype=np.uint8):
+    """Return a BackgroundSource for path, or None when nothing can be read from it"""
+    if not path or not os.path.exists(path):
+        return None
+    source = BackgroundSource(path, resolution, warn_resize, grayscale, dtype)
+    if len(source) == 0:
+        source.close()
+        return None
+    return source
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import itertools
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from IPI_generator import CircleImageCreator
+from bubble_generator import generate_bubble_video
+from frame_store import output_path
+from video_writers import video_extension
+
+GENERATORS = ("ipi", "bubble")
+
+
+def expand_manifest(manifest):
+    """Expand the manifest "jobs" list and "grids" parameter grids into a flat list of jobs
+
+    A job is {"generator": "ipi" | "bubble", "seed": int, "params": {...}}. A grid is
+    {"generator": ..., "seeds": [...], "params": {name: [values, ...]}} and yields one job per
+    seed and combination of parameter values.
+    """
+    jobs = []
+    for job in manifest.get("jobs", []):
+        jobs.append({"generator": job["generator"], "seed": job.get("seed", len(jobs)),
+                     "params": dict(job.get("params", {}))})
+    for grid in manifest.get("grids", []):
+        keys = sorted(grid.get("params", {}))
+        for values in itertools.product(*(grid["params"][k] for k in keys)):
+            for seed in grid.get("seeds", [0]):
+                jobs.append({"generator": grid["generator"], "seed": seed, "params": dict(zip(keys, values))})
+    for job in jobs:
+        if job["generator"] not in GENERATORS:
+            raise ValueError(f"Unknown generator {job['generator']!r}, expected one of {GENERATORS}")
+        job["name"] = job_name(job)
+    return jobs
+
+
+def job_name(job):
+    """Return a stable clip name derived from the generator, seed and parameters"""
+    digest = hashlib.sha1(json.dumps(job["params"], sort_keys=True).encode()).hexdigest()[:8]
+    return f"{job['generator']}_s{job['seed']}_{digest}"
+
+
+def run_job(job, output_dir):
+    """Generate one clip into output_dir/<name>/ and return its index record"""
+    job_dir = os.path.join(output_dir, job["name"])
+    record_path = os.path.join(job_dir, "job.json")
+    if os.path.exists(record_path):
+        with open(record_path) as f:
+            record = json.load(f)
+        record["skipped"] = True
+        return record
+    os.makedirs(job_dir, exist_ok=True)
+    name = job["name"]
+    if job["generator"] == "ipi":
+        params = {"stream_video": True, "seed": job["seed"], **job["params"]}
+        creator = CircleImageCreator(save_path=job_dir, output_video_path=job_dir, **params)
+        creator.create_images(ext=name)
+        if creator.make_video and not creator.stream_video:
+            creator.make_video_file(name)
+        video = creator.video_file_path(name)
+        ground_truth = [os.path.basename(creator.ground_truth_path(name)),
+                        f"circles_properties_synth_{name}.txt", f"circles_properties_synth_noduplicate_{name}.txt"]
+    else:
+        video = os.path.join(job_dir, f"bubble_simulation_{name}{video_extension(job['params'].get('codec', 'mp4v'))}")
+        ground_truth = [f"bubble_data_{name}.csv"]
+        generate_bubble_video(video_path=video, csv_path=os.path.join(job_dir, ground_truth[0]),
+                              seed=job["seed"], **job["params"])
+        video = output_path(video, job["params"].get("output_format", "video"))
+    record = {
+        "name": name,
+        "generator": job["generator"],
+        "seed": job["seed"],
+        "params": job["params"],
+        "video": os.path.relpath(video, output_dir),
+        "ground_truth": [os.path.join(name, f) for f in ground_truth],
+    }
+    # The record is written last: its presence marks the clip as complete
+    with open(record_path, "w") as f:
+        json.dump(record, f, indent=2)
+    record["skipped"] = False
+    return record
+
+
+def run_batch(manifest, output_dir, workers=1):
+    """Generate every job of a manifest, then write output_dir/index.json"""
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = expand_manifest(manifest)
+    names = [job["name"] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("The manifest contains duplicate jobs (same generator, seed and parameters)")
+    records = {}
+    if workers <= 1:
+        for job in jobs:
+            records[job["name"]] = run_job(job, output_dir)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(run_job, job, output_dir) for job in jobs]
+            for future in as_completed(futures):
+                record = future.result()
+                records[record["name"]] = record
+    index = [records[name] for name in names]
+    skipped = sum(record.pop("skipped") for record in index)
+    with open(os.path.join(output_dir, "index.json"), "w") as f:
+        json.dump(index, f, indent=2)
+    print(f"Batch completed: {len(index) - skipped} clips generated, {skipped} already present.")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a dataset of seeded videos from a JSON manifest.")
+    parser.add_argument("manifest", type=str)
+    parser.add_argument("--output_dir", type=str, default=None)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    output_dir = args.output_dir or manifest.get("output_dir") or os.path.join(os.path.dirname(os.path.abspath(args.manifest)), "dataset")
+    run_batch(manifest, output_dir, workers=args.workers)
+
+if __name__ == '__main__':
+    main()
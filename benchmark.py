@@ -0,0 +1,102 @@
+import io
+import os
+import json
+import time
+import argparse
+import itertools
+import platform
+import tempfile
+from contextlib import redirect_stdout
+import cv2
+import numpy as np
+from IPI_generator import CircleImageCreator
+from bubble_generator import generate_bubble_video
+
+
+def benchmark_ipi(resolution, n_objects, blur_radius, n_frames, seed=0):
+    """Render n_frames IPI frames in memory and return the StageTimer report"""
+    creator = CircleImageCreator(n_circles=n_objects, n_blobs=max(1, n_objects // 4),
+                                 apply_blur=blur_radius > 0, blur_radius=max(blur_radius, 1),
+                                 fps=n_frames, video_duration=1, seed=seed, profile=True, resolution=resolution)
+    timer = creator.timer
+    states = timer.timed_iter("simulation", creator.simulate_frames(resolution, io.StringIO()))
+    for state in states:
+        frame = creator.render_frame(state)
+        with timer.stage("encode"):
+            cv2.imencode(".png", frame, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+        timer.end_frame()
+    return timer.report()
+
+
+def benchmark_bubbles(resolution, n_objects, n_frames, seed=0, fps=20):
+    """Generate a bubble video and its ground truth in a temporary folder and return the profile report
+
+    This is the run of generate_bubble_video with its default codec, timed by its own profiler.
+    The spawn interval is chosen so that about n_objects bubbles are on screen at once, and the
+    video lasts whole seconds, so n_frames is rounded up to a multiple of fps.
+    """
+    width, height = resolution
+    frames_on_screen = height / (300 / fps)
+    spawn_interval_frames = max(1, int(frames_on_screen / max(n_objects, 1)))
+    with tempfile.TemporaryDirectory() as folder, redirect_stdout(io.StringIO()):
+        # Half a frame over the interval, so the generator's int(fps * spawn_interval) gives it back
+        generate_bubble_video(width, height, fps, max(1, -(-n_frames // fps)), (spawn_interval_frames + 0.5) / fps,
+                              video_path=os.path.join(folder, "bubbles.mp4"),
+                              csv_path=os.path.join(folder, "bubbles.csv"), profile=True, seed=seed)
+        with open(os.path.join(folder, "bubbles_profile.json")) as f:
+            return json.load(f)
+
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure frames per second of both generators over a parameter "
+                                                 "sweep (blur radii apply to the IPI generator only).")
+    parser.add_argument("--generators", type=str, default="ipi,bubble")
+    parser.add_argument("--resolutions", type=str, default="1024x512,2048x1024")
+    parser.add_argument("--objects", type=str, default="10,50,200")
+    parser.add_argument("--blur_radii", type=str, default="0,5,15")
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default="benchmark.json")
+    args = parser.parse_args()
+
+    generators = args.generators.split(",")
+    resolutions = [parse_resolution(r) for r in args.resolutions.split(",")]
+    objects = [int(n) for n in args.objects.split(",")]
+    blur_radii = [int(b) for b in args.blur_radii.split(",")]
+
+    results = []
+    print(f"{'generator':<10}{'resolution':>12}{'objects':>9}{'blur':>6}{'fps':>9}{'ms/frame':>10}")
+    # The bubble generator has no blur: it is run once per resolution and object count
+    cases = [(generator, resolution, n_objects, blur_radius)
+             for generator, resolution, n_objects in itertools.product(generators, resolutions, objects)
+             for blur_radius in (blur_radii if generator == "ipi" else [None])]
+    for generator, resolution, n_objects, blur_radius in cases:
+        start = time.perf_counter()
+        if generator == "ipi":
+            report = benchmark_ipi(resolution, n_objects, blur_radius, args.frames, seed=args.seed)
+        else:
+            report = benchmark_bubbles(resolution, n_objects, args.frames, seed=args.seed)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "generator": generator,
+            "resolution": list(resolution),
+            "objects": n_objects,
+            "blur_radius": blur_radius,
+            "frames": report["frames"],
+            "fps": report["frames"] / elapsed,
+            "stages": report["stages"],
+        })
+        print(f"{generator:<10}{'%dx%d' % resolution:>12}{n_objects:>9}{'-' if blur_radius is None else blur_radius:>6}"
+              f"{results[-1]['fps']:>9.1f}{1000 * elapsed / max(report['frames'], 1):>10.1f}")
+    with open(args.output, "w") as f:
+        json.dump({"opencv": cv2.__version__, "numpy": np.__version__, "python": platform.python_version(),
+                   "machine": platform.machine(), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,379 @@
 import os
-import csv
 import cv2
 import numpy as np
 from tqdm import tqdm
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from ground_truth import GroundTruthWriter, ground_truth_format
+from profiling import StageTimer, print_report
+from frame_stream import prefetch_iter
+from frame_store import OUTPUT_FORMATS, output_path, open_frame_store
+from video_writers import (VIDEO_CODECS, PartedVideoWriter, open_video_writer, segment_ranges, segment_paths,
+                           concat_segments, remove_files, video_extension, check_container, require_ffmpeg)
+from checkpoint import save_checkpoint, load_checkpoint, remove_checkpoint, start_without_checkpoint
+from sensor_noise import SensorNoise, sensor_noise_enabled
+
+BUBBLE_GROUND_TRUTH_COLUMNS = [
+    ("frame", np.int64), ("bubble_id", np.int64), ("x", np.int64), ("y", np.int64),
+    ("radius", np.int64), ("velocity", np.float64),
+]
+
+class BubbleSimulation:
+    """Bubbles rising in three columns, held as one NumPy array per property
+
+    Every bubble that will spawn during the video is drawn up front (spawns happen on a fixed
+    frame schedule), in the same order and with the same np.random calls as one bubble per
+    spawn frame, so a given seed gives the same trajectories. The draws come from random_state,
+    an np.random.RandomState, if given, else from the global np.random. The motion is
+    closed-form in the age of a bubble, so state gives any frame directly: frames can be
+    rendered in any order or split across processes with identical results.
+    """
+    def __init__(self, width, height, fps, total_frames, spawn_interval_frames,
+                 large_radius_probability, radius_decrease_factor, random_state=None):
+        random = np.random if random_state is None else random_state
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.radius_decrease_factor = radius_decrease_factor
+        n_bubbles = (total_frames + spawn_interval_frames - 1) // spawn_interval_frames
+        self.start_frame = np.arange(n_bubbles) * spawn_interval_frames
+        self.velocity = np.empty(n_bubbles)
+        self.amplitude = np.empty(n_bubbles)
+        self.frequency = np.empty(n_bubbles)
+        self.phase = np.empty(n_bubbles)
+        self.initial_radius = np.empty(n_bubbles, dtype=int)
+        for i in range(n_bubbles):
+            self.velocity[i] = random.uniform(250, 350)
+            self.amplitude[i] = random.uniform(20, 40)
+            self.frequency[i] = random.uniform(0.5, 1.0)
+            self.phase[i] = random.uniform(0, 2 * np.pi)
+            if random.random() < large_radius_probability:
+                self.initial_radius[i] = random.randint(50, 61)
+            else:
+                self.initial_radius[i] = random.randint(20, 31)
+        self.velocity_per_frame = self.velocity / fps
+        column = np.arange(n_bubbles) % 3
+        self.x_base = np.choose(column, [width // 4, width // 2, 3 * width // 4])
+        self.lifetime = self._lifetimes()
+        self.max_lifetime = int(self.lifetime.max(initial=0))
+
+    def _radius_at(self, ids, y):
+        """Return the radius of bubbles at height y above the bottom edge"""
+        normalized_y = np.maximum(0, y / self.height)
+        return np.maximum(1, (self.initial_radius[ids] * normalized_y ** self.radius_decrease_factor).astype(int))
+
+    def _lifetimes(self):
+        """Return the number of frames each bubble is visible
+
+        A bubble is dropped for good at the first age where, before moving, its bottom-edge
+        height minus its radius is no longer positive (it has left through the top).
+        """
+        n_bubbles = len(self.start_frame)
+        lifetime = np.empty(n_bubbles, dtype=np.int64)
+        if n_bubbles == 0:
+            return lifetime
+        # Every bubble is gone once its height is negative, and while radii only shrink a bubble
+        # higher than its initial radius is still visible: only the ages in between are tested
+        end = np.ceil(self.height / self.velocity_per_frame).astype(np.int64) + 1
+        begin = np.zeros(n_bubbles, dtype=np.int64)
+        if self.radius_decrease_factor >= 0:
+            begin = np.maximum(0, np.floor((self.height - self.initial_radius) / self.velocity_per_frame).astype(np.int64) - 1)
+        window = np.arange(int((end - begin).max()) + 1)
+        chunk = max(1, (1 << 20) // len(window))
+        for first in range(0, n_bubbles, chunk):
+            ids = np.arange(first, min(first + chunk, n_bubbles))[:, None]
+            ages = begin[ids] + window
+            y = self.height - ages * self.velocity_per_frame[ids]
+            radius = np.where(ages == 0, self.initial_radius[ids], self._radius_at(ids, y))
+            lifetime[ids[:, 0]] = begin[ids[:, 0]] + np.argmin(y - radius > 0, axis=1)
+        return lifetime
+
+    def state(self, frame_idx):
+        """Return (ids, x, y, radius) of the bubbles visible at frame_idx"""
+        first = np.searchsorted(self.start_frame, frame_idx - self.max_lifetime, side='right')
+        last = np.searchsorted(self.start_frame, frame_idx, side='right')
+        ids = np.arange(first, last)
+        age = frame_idx - self.start_frame[ids]
+        ids, age = ids[age < self.lifetime[ids]], age[age < self.lifetime[ids]]
+        t = age / self.fps
+        y = self.height - (age + 1) * self.velocity_per_frame[ids]
+        # x is kept inside the frame by the radius of the previous frame
+        previous_radius = np.where(age == 0, self.initial_radius[ids],
+                                   self._radius_at(ids, self.height - age * self.velocity_per_frame[ids]))
+        x_offset = self.amplitude[ids] * np.sin(2 * np.pi * self.frequency[ids] * t + self.phase[ids])
+        x = np.clip(self.x_base[ids] + x_offset, previous_radius, self.width - previous_radius)
+        return ids, x.astype(int), y.astype(int), self._radius_at(ids, y)
+
+def draw_bubble_frame(width, height, x, y, radius):
+    """Draw black bubbles on a white single-channel frame"""
+    frame = np.full((height, width), 255, dtype=np.uint8)
+    for bubble_x, bubble_y, bubble_radius in zip(x.tolist(), y.tolist(), radius.tolist()):
+        cv2.circle(frame, (bubble_x, bubble_y), bubble_radius, 0, -1)
+    return frame
+
+class BubbleRenderer:
+    """Draw bubble frames into one persistent buffer, byte-identical to draw_bubble_frame
+
+    Instead of filling a new white frame, only the bounding boxes of the previous frame's bubbles
+    are erased before the new bubbles are drawn: the buffer is white everywhere else already.
+    The returned frame is the buffer itself, overwritten by the next call; copy it to keep it.
+    """
+    def __init__(self, width, height):
+        self.frame = np.full((height, width), 255, dtype=np.uint8)
+        self._boxes = []
+
+    def draw(self, x, y, radius):
+        for x0, y0, x1, y1 in self._boxes:
+            self.frame[y0:y1, x0:x1] = 255
+        self._boxes = []
+        for bubble_x, bubble_y, bubble_radius in zip(x.tolist(), y.tolist(), radius.tolist()):
+            cv2.circle(self.frame, (bubble_x, bubble_y), bubble_radius, 0, -1)
+            self._boxes.append((max(0, bubble_x - bubble_radius), max(0, bubble_y - bubble_radius),
+                                max(0, bubble_x + bubble_radius + 1), max(0, bubble_y + bubble_radius + 1)))
+        return self.frame
+
+def bubble_random_state(seed):
+    """Return the RandomState of a run seeded with seed, or None (the global np.random) without a seed
+
+    RandomState(seed) draws the same numbers as np.random after np.random.seed(seed).
+    """
+    return None if seed is None else np.random.RandomState(seed)
+
+def bubble_sensor_noise(gain, shot_noise, read_noise, fixed_pattern_noise, random_state=None):
+    """Return the SensorNoise of a run, seeded from the stream of its bubbles after them (None without noise)"""
+    if not sensor_noise_enabled(gain, shot_noise, read_noise, fixed_pattern_noise):
+        return None
+    random = np.random if random_state is None else random_state
+    return SensorNoise(random.randint(2 ** 31), gain, shot_noise, read_noise, fixed_pattern_noise)
+
+def iter_bubble_frames(width=1000, height=1000, fps=20, duration=10, spawn_interval=0.25,
+                       large_radius_probability=0.2, radius_decrease_factor=0.25, prefetch=0, frames=None,
+                       gain=1.0, shot_noise=0.0, read_noise=0.0, fixed_pattern_noise=0.0, seed=None):
+    """Yield (frame index, frame, ground truth columns) for every frame, without writing anything
+
+    The ground truth is a dict of BUBBLE_GROUND_TRUTH_COLUMNS arrays, one entry per visible
+    bubble. The bubbles are drawn when this is called, from np.random.RandomState(seed) with a
+    seed and from the global np.random without; frames are drawn lazily, up to prefetch frames
+    ahead on a background thread when prefetch > 0. frames, if given, is an iterable of frame
+    indices to render instead of all of them, in any order: each frame is the same as in the
+    full video. gain and the noise levels add camera sensor noise to the frames (see
+    sensor_noise.SensorNoise).
+    """
+    total_frames = fps * duration
+    random_state = bubble_random_state(seed)
+    simulation = BubbleSimulation(width, height, fps, total_frames, max(1, int(fps * spawn_interval)),
+                                  large_radius_probability, radius_decrease_factor, random_state)
+    noise = bubble_sensor_noise(gain, shot_noise, read_noise, fixed_pattern_noise, random_state)
+
+    def render(indices):
+        for frame_idx in indices:
+            ids, x, y, radius = simulation.state(frame_idx)
+            frame = draw_bubble_frame(width, height, x, y, radius)
+            if noise is not None:
+                noise.apply(frame, frame_idx)
+            yield frame_idx, frame, {
+                "frame": np.full(len(ids), frame_idx), "bubble_id": ids, "x": x, "y": y,
+                "radius": radius, "velocity": simulation.velocity[ids]}
+
+    indices = range(total_frames) if frames is None else frames
+    return prefetch_iter(render(indices), prefetch) if prefetch > 0 else render(indices)
+
+def encode_bubble_segment(simulation, start, count, path, codec, quality, noise=None):
+    """Draw and encode frames [start, start + count) of a simulation, with an optional SensorNoise"""
+    writer = open_video_writer(path, simulation.fps, codec, quality=quality)
+    renderer = BubbleRenderer(simulation.width, simulation.height)
+    noisy = np.empty_like(renderer.frame) if noise is not None else None
+    try:
+        for frame_idx in range(start, start + count):
+            ids, x, y, radius = simulation.state(frame_idx)
+            frame = renderer.draw(x, y, radius)
+            writer.write(noise.apply(frame, frame_idx, out=noisy) if noise is not None else frame)
+    finally:
+        writer.close()
+    return count
+
+def generate_bubble_video(width=1000, height=1000, fps=20, duration=10, spawn_interval=0.25,
+                          large_radius_probability=0.2, radius_decrease_factor=0.25,
+                          video_path=None, csv_path=None, profile=False, progress=None,
+                          codec="mp4v", quality=None, segment_frames=0, encode_workers=None,
+                          output_format="video", checkpoint_interval=0, resume=False,
+                          gain=1.0, shot_noise=0.0, read_noise=0.0, fixed_pattern_noise=0.0, seed=None):
+    """Generate a video of bubbles rising in columns and its CSV ground truth
+
+    codec is mp4v (cv2.VideoWriter) or an ffmpeg codec (libx264, ffv1, mjpeg) with its quality.
+    FFV1 cannot go in MP4: the default video_path is then bubble_simulation.mkv, and a video_path
+    with another container than .mkv, .avi or .nut is rejected before rendering.
+    With segment_frames > 0 the video is cut into segments of that many frames, drawn and
+    encoded concurrently by encode_workers processes (default the CPU count) and joined
+    without re-encoding (needs ffmpeg); the ground truth is written by this process meanwhile.
+    With profile, per-stage frame timings are written next to the video as <video>_profile.json.
+    progress, if given, is called as progress(frame, total_frames) after each frame is written
+    (after each segment when segmented); an exception raised from it stops the generation
+    after closing the outputs. With output_format npy or h5 the frames are stored uncompressed
+    instead, next to video_path with that extension (see frame_store.load_frames).
+    With checkpoint_interval > 0 the simulation and output offsets are saved next to the video as
+    <video>_checkpoint.pkl every checkpoint_interval frames (after each segment when segmented),
+    the video being encoded in one part per interval and joined at the end (needs ffmpeg and CSV
+    ground truth); resume continues from that checkpoint, giving the same outputs as an
+    uninterrupted run, and raises ValueError without checkpoint_interval, with a checkpoint of
+    other parameters, or without a checkpoint once the video or ground truth exists. gain, shot_noise, read_noise and fixed_pattern_noise add camera sensor
+    noise to the frames (see sensor_noise.SensorNoise); the ground truth is unchanged.
+    With a seed the bubbles and the noise are drawn from their own np.random.RandomState(seed),
+    as after np.random.seed(seed), so runs sharing a process do not share a stream; without one
+    they are drawn from the global np.random.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    video_path = video_path or os.path.join(script_dir, "bubble_simulation" + video_extension(codec))
+    csv_path = csv_path or os.path.join(script_dir, "bubble_data.csv")
+    video_path = output_path(video_path, output_format)
+    if output_format == "video":
+        check_container(video_path, codec)
+        # ffmpeg codecs, and checkpointed and segmented videos (joined by ffmpeg), fail before any output is opened
+        if codec in VIDEO_CODECS:
+            require_ffmpeg(f"Writing {codec} video")
+        if checkpoint_interval or len(segment_ranges(fps * duration, segment_frames)) > 1:
+            require_ffmpeg("Joining video parts or segments")
+
+    # Total frames
+    total_frames = fps * duration
+    bubble_spawn_interval = max(1, int(fps * spawn_interval))
+
+    if resume and not checkpoint_interval:
+        raise ValueError("Resuming needs the checkpoint_interval of the interrupted run")
+    if checkpoint_interval and ground_truth_format(csv_path) != "csv":
+        raise ValueError("Checkpoints need csv ground truth")
+    checkpoint_path = os.path.splitext(video_path)[0] + "_checkpoint.pkl" if checkpoint_interval else None
+    signature = {
+        "width": width, "height": height, "fps": fps, "duration": duration, "spawn_interval": spawn_interval,
+        "large_radius_probability": large_radius_probability, "radius_decrease_factor": radius_decrease_factor,
+        "codec": codec, "quality": quality, "segment_frames": segment_frames, "output_format": output_format,
+        "checkpoint_interval": checkpoint_interval,
+        "sensor_noise": (gain, shot_noise, read_noise, fixed_pattern_noise),
+    }
+    checkpoint = load_checkpoint(checkpoint_path, signature) if resume else None
+    if resume and checkpoint is None:
+        start_without_checkpoint(checkpoint_path, [video_path, csv_path])
+
+    # Ground truth, CSV by default or NPZ/Parquet according to the csv_path extension
+    ground_truth = GroundTruthWriter(csv_path, BUBBLE_GROUND_TRUTH_COLUMNS,
+                                     offset=checkpoint["ground_truth_offset"] if checkpoint else None)
+
+    # A resumed run takes the bubbles of the interrupted one, as they were drawn at random
+    if checkpoint is not None:
+        simulation, noise = checkpoint["simulation"], checkpoint["noise"]
+    else:
+        random_state = bubble_random_state(seed)
+        simulation = BubbleSimulation(width, height, fps, total_frames, bubble_spawn_interval,
+                                      large_radius_probability, radius_decrease_factor, random_state)
+        noise = bubble_sensor_noise(gain, shot_noise, read_noise, fixed_pattern_noise, random_state)
+
+    def save(**position):
+        save_checkpoint(checkpoint_path, dict(position, signature=signature, simulation=simulation, noise=noise,
+                                              ground_truth_offset=ground_truth.tell()))
+
+    timer = StageTimer(profile)
+    segments = segment_ranges(total_frames, segment_frames)
+    if len(segments) > 1 and output_format == "video":
+        try:
+            _generate_segmented(simulation, ground_truth, segments, video_path, codec, quality, encode_workers,
+                                timer, progress, save if checkpoint_interval else None,
+                                checkpoint["segments_done"] if checkpoint else 0, noise)
+        finally:
+            ground_truth.close()
+        if checkpoint_path:
+            remove_checkpoint(checkpoint_path)
+        if profile:
+            print_report(timer.write_json(os.path.splitext(video_path)[0] + "_profile.json"))
+        return
+
+    start = checkpoint["frame"] + 1 if checkpoint else 0
+    renderer = BubbleRenderer(width, height)
+    # Noise is added into its own buffer: the renderer buffer must stay clean for the next frame
+    noisy = np.empty_like(renderer.frame) if noise is not None else None
+    # Video writer, in one part per checkpoint interval so a resumed run keeps the finished parts
+    if output_format == "video" and checkpoint_interval:
+        video = PartedVideoWriter(video_path, partial(open_video_writer, fps=fps, codec=codec, quality=quality),
+                                  checkpoint_interval, total_frames, start,
+                                  ".mkv" if codec in VIDEO_CODECS else os.path.splitext(video_path)[1])
+    elif output_format == "video":
+        video = open_video_writer(video_path, fps, codec, quality=quality)
+    else:
+        video = open_frame_store(video_path, total_frames, fps, start)
+    try:
+        with tqdm(total=total_frames, initial=start, desc="Generating video") as pbar:
+            for frame_idx in range(start, total_frames):
+                with timer.stage("simulation"):
+                    ids, x, y, radius = simulation.state(frame_idx)
+                with timer.stage("draw"):
+                    frame = renderer.draw(x, y, radius)
+                if noise is not None:
+                    with timer.stage("noise"):
+                        frame = noise.apply(frame, frame_idx, out=noisy)
+                with timer.stage("ground_truth"):
+                    ground_truth.append(frame=frame_idx, bubble_id=ids, x=x, y=y, radius=radius,
+                                        velocity=simulation.velocity[ids])
+                with timer.stage("write"):
+                    video.write(frame)
+                if checkpoint_interval and (frame_idx + 1) % checkpoint_interval == 0 and frame_idx + 1 < total_frames:
+                    if hasattr(video, "flush"):
+                        video.flush()
+                    save(frame=frame_idx)
+                timer.end_frame()
+                pbar.update(1)
+                if progress is not None:
+                    progress(frame_idx + 1, total_frames)
+    finally:
+        video.close()
+        ground_truth.close()
+    if checkpoint_path:
+        remove_checkpoint(checkpoint_path)
+    if profile:
+        print_report(timer.write_json(os.path.splitext(video_path)[0] + "_profile.json"))
+
+def _generate_segmented(simulation, ground_truth, segments, video_path, codec, quality, encode_workers,
+                        timer, progress, save=None, segments_done=0, noise=None):
+    """Render and encode every segment on a process pool while this process writes the ground truth
+
+    With save, save(segments_done=n) is called once the ground truth and the first n segments
+    are written, and the finished segments are kept if the run stops. A run resumed with
+    segments_done > 0 already has its ground truth and encodes the remaining segments only.
+    """
+    # cv2.VideoWriter segments use the container of the output, ffmpeg ones Matroska
+    parts = segment_paths(video_path, len(segments),
+                          ".mkv" if codec in VIDEO_CODECS else os.path.splitext(video_path)[1])
+    require_ffmpeg("Joining video segments")
+    total_frames = segments[-1][0] + segments[-1][1]
+    # Spawned, not forked, as GUI jobs call this from a thread
+    pool = ProcessPoolExecutor(encode_workers or os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = [pool.submit(encode_bubble_segment, simulation, start, count, part, codec, quality, noise)
+                   for (start, count), part in list(zip(segments, parts))[segments_done:]]
+        if not segments_done:
+            for frame_idx in range(total_frames):
+                with timer.stage("simulation"):
+                    ids, x, y, radius = simulation.state(frame_idx)
+                with timer.stage("ground_truth"):
+                    ground_truth.append(frame=frame_idx, bubble_id=ids, x=x, y=y, radius=radius,
+                                        velocity=simulation.velocity[ids])
+                timer.end_frame()
+        written = sum(count for _, count in segments[:segments_done])
+        with tqdm(total=total_frames, initial=written, desc="Generating video") as pbar:
+            for done, future in enumerate(futures, segments_done + 1):
+                count = future.result()
+                written += count
+                if save is not None and done < len(segments):
+                    save(segments_done=done)
+                pbar.update(count)
+                if progress is not None:
+                    progress(written, total_frames)
+        concat_segments(parts, video_path)
+        remove_files(parts)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if save is None:
+            remove_files(parts)
 
 def main():
     parser = argparse.ArgumentParser(description="Generate a video of bubbles rising in columns.")
@@ -14,74 +384,27 @@ def main():
     parser.add_argument("--spawn_interval", type=float, default=0.25)
     parser.add_argument("--large_radius_probability", type=float, default=0.2)
     parser.add_argument("--radius_decrease_factor", type=float, default=0.25)
-    parser.add_argument("--video_path", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "bubble_simulation.mp4"))
+    # Default: bubble_simulation.mp4 next to this script, .mkv for ffv1
+    parser.add_argument("--video_path", type=str, default=None)
     parser.add_argument("--csv_path", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "bubble_data.csv"))
+    parser.add_argument("--profile", type=int, default=0)
+    parser.add_argument("--codec", type=str, default="mp4v", choices=["mp4v"] + list(VIDEO_CODECS))
+    parser.add_argument("--quality", type=int, default=None)
+    parser.add_argument("--segment_frames", type=int, default=0)
+    parser.add_argument("--encode_workers", type=int, default=None)
+    parser.add_argument("--output_format", type=str, default="video", choices=list(OUTPUT_FORMATS))
+    parser.add_argument("--checkpoint_interval", type=int, default=0)
+    parser.add_argument("--resume", type=int, default=0)
+    parser.add_argument("--gain", type=float, default=1.0)
+    parser.add_argument("--shot_noise", type=float, default=0.0)
+    parser.add_argument("--read_noise", type=float, default=0.0)
+    parser.add_argument("--fixed_pattern_noise", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
     args = parser.parse_args()
+    args.profile = bool(args.profile)
+    args.resume = bool(args.resume)
 
-    # Total frames
-    total_frames = args.fps * args.duration
-    bubble_spawn_interval = max(1, int(args.fps * args.spawn_interval))
-
-    # Video writer
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    video = cv2.VideoWriter(args.video_path, fourcc, args.fps, (args.width, args.height), isColor=False)
-
-    # CSV
-    csv_file = open(args.csv_path, mode='w', newline='')
-    csv_writer = csv.writer(csv_file)
-    csv_writer.writerow(['frame', 'bubble_id', 'x', 'y', 'radius', 'velocity'])
-
-    class Bubble:
-        def __init__(self, bubble_id, start_frame, column):
-            self.id = bubble_id
-            self.velocity = np.random.uniform(250, 350)
-            self.velocity_per_frame = self.velocity / args.fps
-            self.column = column
-            self.x_base = args.width // 4 if column == 0 else (args.width // 2 if column == 1 else 3 * args.width // 4)
-            self.y = args.height
-            self.amplitude = np.random.uniform(20, 40)
-            self.frequency = np.random.uniform(0.5, 1.0)
-            self.phase = np.random.uniform(0, 2 * np.pi)
-            self.start_frame = start_frame
-            if np.random.random() < args.large_radius_probability:
-                self.initial_radius = np.random.randint(50, 61)
-            else:
-                self.initial_radius = np.random.randint(20, 31)
-            self.radius = self.initial_radius
-
-        def update_position(self, frame_idx):
-            t = (frame_idx - self.start_frame) / args.fps
-            self.y -= self.velocity_per_frame
-            x_offset = self.amplitude * np.sin(2 * np.pi * self.frequency * t + self.phase)
-            x = np.clip(self.x_base + x_offset, self.radius, args.width - self.radius)
-            normalized_y = max(0, self.y / args.height)
-            self.radius = max(1, int(self.initial_radius * (normalized_y) ** args.radius_decrease_factor))
-            return int(x), int(self.y)
-
-    bubbles = []
-    bubble_id_counter = 0
-
-    with tqdm(total=total_frames, desc="Generating video") as pbar:
-        for frame_idx in range(total_frames):
-            frame = np.full((args.height, args.width), 255, dtype=np.uint8)
-            if frame_idx % bubble_spawn_interval == 0:
-                column = bubble_id_counter % 3
-                bubbles.append(Bubble(bubble_id_counter, frame_idx, column))
-                bubble_id_counter += 1
-
-            active_bubbles = []
-            for bubble in bubbles:
-                if bubble.y - bubble.radius > 0:
-                    x, y = bubble.update_position(frame_idx)
-                    cv2.circle(frame, (x, y), bubble.radius, 0, -1)
-                    csv_writer.writerow([frame_idx, bubble.id, x, y, bubble.radius, bubble.velocity])
-                    active_bubbles.append(bubble)
-            bubbles = active_bubbles
-            video.write(frame)
-            pbar.update(1)
-
-    video.release()
-    csv_file.close()
+    generate_bubble_video(**vars(args))
 
 if __name__ == '__main__':
     main()
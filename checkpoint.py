@@ -0,0 +1,59 @@
+import os
+import pickle
+
+
+def save_checkpoint(path, data):
+    """Pickle a checkpoint atomically: a crash while saving leaves the previous checkpoint intact"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, signature):
+    """Return the checkpoint saved at path, or None without one
+
+    signature holds the parameters the run depends on; a checkpoint saved with different ones
+    raises ValueError instead of resuming into mismatched outputs.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        data = pickle.load(f)
+    if data["signature"] != signature:
+        changed = sorted(key for key in set(signature) | set(data["signature"])
+                         if signature.get(key) != data["signature"].get(key))
+        raise ValueError(f"Checkpoint {path} was saved with different parameters ({', '.join(changed)})")
+    return data
+
+
+def start_without_checkpoint(path, outputs):
+    """Check that a run resumed without a checkpoint at path can start from its first frame
+
+    That is only safe before the run wrote anything: if any of outputs exists (the run finished
+    and removed its checkpoint, or stopped before its first one), ValueError is raised instead
+    of overwriting it.
+    """
+    existing = [output for output in outputs if os.path.exists(output)]
+    if existing:
+        raise ValueError(f"No checkpoint {path} to resume from, and starting again would overwrite "
+                         f"{', '.join(existing)}")
+    print(f"No checkpoint {path} and no outputs yet, starting the run from its first frame.")
+
+
+def remove_checkpoint(path):
+    """Delete the checkpoint of a finished run"""
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def open_text_output(path, offset=None):
+    """Open a text output for writing: truncated, or kept up to offset (from tell) to resume a run"""
+    if offset is None:
+        return open(path, "w")
+    f = open(path, "r+")
+    f.seek(offset)
+    f.truncate()
+    return f
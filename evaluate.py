@@ -0,0 +1,161 @@
+import json
+import argparse
+import numpy as np
+from scipy.spatial import cKDTree
+from ground_truth import GroundTruthWriter, read_ground_truth
+
+# Object identifier column of the IPI and bubble ground truth
+ID_COLUMNS = ("object_id", "bubble_id")
+
+MATCH_COLUMNS = [
+    ("frame", np.int64), ("detection", np.int64), ("object_id", np.int64), ("distance", np.float64),
+]
+
+
+def match_detections(truth_frame, truth_xy, detection_frame, detection_xy, gate):
+    """Match detections one to one with ground truth objects of the same frame within gate pixels
+
+    Pairs are accepted by increasing distance (greedy matching), for all frames at once: the
+    frame index is a third coordinate, 2 * gate apart, so a KD-tree only pairs objects of the
+    same frame, and the greedy matching is computed as rounds of mutual nearest neighbours.
+    Returns the (truth indices, detection indices, distances) of the matched pairs.
+    """
+    spacing = 2 * gate
+    truth_points = np.column_stack([truth_xy, np.asarray(truth_frame, dtype=float) * spacing])
+    detection_points = np.column_stack([detection_xy, np.asarray(detection_frame, dtype=float) * spacing])
+    pairs = cKDTree(truth_points).sparse_distance_matrix(cKDTree(detection_points), gate, output_type="ndarray")
+    t, d, distance = pairs["i"].astype(np.int64), pairs["j"].astype(np.int64), pairs["v"]
+    truth_used, detection_used = np.zeros(len(truth_points), dtype=bool), np.zeros(len(detection_points), dtype=bool)
+    matched = []
+    while len(t):
+        # Closest detection of every object and closest object of every detection (ties by index)
+        mutual = np.zeros(len(t), dtype=bool)
+        order = np.lexsort((d, distance, t))
+        mutual[order[np.r_[True, t[order][1:] != t[order][:-1]]]] = True
+        nearest_of_detection = np.zeros(len(t), dtype=bool)
+        order = np.lexsort((t, distance, d))
+        nearest_of_detection[order[np.r_[True, d[order][1:] != d[order][:-1]]]] = True
+        mutual &= nearest_of_detection
+        matched.append((t[mutual], d[mutual], distance[mutual]))
+        truth_used[t[mutual]] = True
+        detection_used[d[mutual]] = True
+        keep = ~truth_used[t] & ~detection_used[d]
+        t, d, distance = t[keep], d[keep], distance[keep]
+    if not matched:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return tuple(np.concatenate(column) for column in zip(*matched))
+
+
+def error_summary(errors):
+    """Return the mean, median, RMSE and maximum of absolute errors (None without any)"""
+    errors = np.abs(errors)
+    if len(errors) == 0:
+        return {"mean": None, "median": None, "rmse": None, "max": None}
+    return {
+        "mean": float(errors.mean()),
+        "median": float(np.median(errors)),
+        "rmse": float(np.sqrt(np.mean(errors ** 2))),
+        "max": float(errors.max()),
+    }
+
+
+def evaluate(truth, detections, gate=10.0):
+    """Score detections against ground truth, both dicts of column arrays as read by read_ground_truth
+
+    Detections need frame, x and y columns; radius and fringe_count are scored when both sides
+    have them, and a track_id column is checked for identity switches against the object ids.
+    Returns (report dict, matched object id of every detection, -1 when unmatched, and distance).
+    """
+    truth_frame, detection_frame = np.asarray(truth["frame"]), np.asarray(detections["frame"])
+    truth_index, detection_index, distance = match_detections(
+        truth_frame, np.column_stack([truth["x"], truth["y"]]),
+        detection_frame, np.column_stack([detections["x"], detections["y"]]), gate)
+    n_truth, n_detections, n_matched = len(truth_frame), len(detection_frame), len(truth_index)
+    precision = n_matched / n_detections if n_detections else 0.0
+    recall = n_matched / n_truth if n_truth else 0.0
+    report = {
+        "gate": gate,
+        "frames": int(len(np.unique(np.concatenate([truth_frame, detection_frame])))),
+        "ground_truth": n_truth,
+        "detections": n_detections,
+        "true_positives": n_matched,
+        "false_positives": n_detections - n_matched,
+        "false_negatives": n_truth - n_matched,
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "localization_error": error_summary(distance),
+    }
+    for column in ("radius", "fringe_count"):
+        if column in truth and column in detections:
+            errors = np.asarray(detections[column], dtype=float)[detection_index] - np.asarray(truth[column], dtype=float)[truth_index]
+            summary = dict(error_summary(errors), bias=float(errors.mean()) if len(errors) else None)
+            if column == "fringe_count":
+                summary["exact"] = float(np.mean(np.round(errors) == 0)) if len(errors) else None
+            report[f"{column}_error"] = summary
+    if "type" in truth:
+        found = np.zeros(n_truth, dtype=bool)
+        found[truth_index] = True
+        report["recall_by_type"] = {str(kind): float(found[truth["type"] == kind].mean())
+                                    for kind in np.unique(truth["type"])}
+
+    id_column = next((column for column in ID_COLUMNS if column in truth), None)
+    object_ids = np.full(n_detections, -1, dtype=np.int64)
+    distances = np.full(n_detections, np.nan)
+    if id_column is not None:
+        object_ids[detection_index] = np.asarray(truth[id_column])[truth_index]
+        distances[detection_index] = distance
+        if "track_id" in detections:
+            report["id_switches"] = id_switches(object_ids[detection_index], truth_frame[truth_index],
+                                                np.asarray(detections["track_id"])[detection_index])
+    return report, object_ids, distances
+
+
+def id_switches(object_ids, frames, track_ids):
+    """Count the times a ground truth object is matched to a different track than in its previous matched frame"""
+    order = np.lexsort((frames, object_ids))
+    object_ids, track_ids = object_ids[order], track_ids[order]
+    return int(np.sum((object_ids[1:] == object_ids[:-1]) & (track_ids[1:] != track_ids[:-1])))
+
+
+def write_matches(path, detections, object_ids, distances):
+    """Write the matched object id and distance of every detection (csv, npz or parquet)"""
+    with GroundTruthWriter(path, MATCH_COLUMNS) as writer:
+        writer.append(frame=np.asarray(detections["frame"]), detection=np.arange(len(object_ids)),
+                      object_id=object_ids, distance=distances)
+
+
+def print_summary(report):
+    print(f"{report['detections']} detections, {report['ground_truth']} objects in {report['frames']} frames "
+          f"(gate {report['gate']} px)")
+    print(f"precision {report['precision']:.4f}  recall {report['recall']:.4f}  f1 {report['f1']:.4f}")
+    for name in ("localization_error", "radius_error", "fringe_count_error"):
+        if name in report and report[name]["mean"] is not None:
+            print(f"{name:<20} mean {report[name]['mean']:.3f}  median {report[name]['median']:.3f}  "
+                  f"rmse {report[name]['rmse']:.3f}  max {report[name]['max']:.3f}")
+    if "recall_by_type" in report:
+        print("recall by type: " + ", ".join(f"{kind} {value:.4f}" for kind, value in report["recall_by_type"].items()))
+    if "id_switches" in report:
+        print(f"id switches {report['id_switches']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a detector's output against generated ground truth.")
+    parser.add_argument("ground_truth", type=str, help="ground_truth_[name].csv/.npz/.parquet or bubble_data.csv")
+    parser.add_argument("detections", type=str, help="Detections with frame, x, y and optionally radius, fringe_count, track_id columns")
+    parser.add_argument("--gate", type=float, default=10.0, help="Largest distance in pixels between a detection and its object")
+    parser.add_argument("--output", type=str, default=None, help="Write the report as JSON")
+    parser.add_argument("--matches", type=str, default=None, help="Write the matched object of every detection")
+    args = parser.parse_args()
+
+    detections = read_ground_truth(args.detections)
+    report, object_ids, distances = evaluate(read_ground_truth(args.ground_truth), detections, args.gate)
+    print_summary(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.matches:
+        write_matches(args.matches, detections, object_ids, distances)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import io
+import os
+import numpy as np
+
+# Outputs of the generators: an encoded video, or every frame in an uncompressed NPY array
+# or a chunked HDF5 dataset for random access by frame index
+OUTPUT_FORMATS = ("video", "npy", "h5")
+
+
+def output_path(video_path, output_format):
+    """Return the output file of a run: video_path itself, or video_path with the frame store extension"""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format {output_format!r}, expected one of {OUTPUT_FORMATS}")
+    if output_format == "video":
+        return video_path
+    return os.path.splitext(video_path)[0] + "." + output_format
+
+
+class NpyFrameWriter:
+    """Write frames into a preallocated memory-mapped .npy array of shape (n_frames, height, width[, 3])
+
+    The array is created from the first frame, so its shape and dtype are in the .npy header and
+    np.load(path, mmap_mode="r")[k] reads frame k without decoding anything. Colour frames are
+    BGR. If the run stops early the array is shrunk to the frames written when closed.
+    With start > 0 the existing array is reopened and written from frame start on, to resume a run.
+    """
+    def __init__(self, path, n_frames, start=0):
+        self.path = path
+        self.n_frames = n_frames
+        self.count = start
+        self._array = None
+
+    def _open(self, shape, dtype):
+        if self.count:
+            resize_npy(self.path, self.n_frames, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            self._array = np.lib.format.open_memmap(self.path, mode="r+")
+            return
+        self._array = np.lib.format.open_memmap(self.path, mode="w+", dtype=dtype,
+                                                shape=(self.n_frames,) + tuple(shape), version=(1, 0))
+
+    def write(self, frame):
+        if self._array is None:
+            self._open(frame.shape, frame.dtype)
+        self._array[self.count] = frame
+        self.count += 1
+
+    def write_bands(self, bands, shape, dtype):
+        """Write a frame of the given shape from consecutive bands of rows, without assembling it"""
+        if self._array is None:
+            self._open(shape, dtype)
+        row = 0
+        for band in bands:
+            self._array[self.count, row:row + len(band)] = band
+            row += len(band)
+        self.count += 1
+
+    def flush(self):
+        if self._array is not None:
+            self._array.flush()
+
+    def close(self):
+        if self._array is None:
+            return
+        self._array.flush()
+        shape, frame_bytes = self._array.shape, self._array[0].nbytes
+        self._array = None
+        if self.count < shape[0]:
+            resize_npy(self.path, self.count, frame_bytes)
+
+
+def resize_npy(path, n_frames, frame_bytes):
+    """Resize a version 1.0 .npy frame array to n_frames frames in place, truncated or zero filled
+
+    The array must have been created with at least n_frames frames, for its header to fit.
+    """
+    with open(path, "r+b") as f:
+        np.lib.format.read_magic(f)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        data_offset = f.tell()
+        header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": fortran_order,
+                  "shape": (n_frames,) + shape[1:]}
+        # Written as np.save and open_memmap write it, so the file matches one created with the
+        # new shape; numpy pads the header to leave room for the frame count to grow
+        buffer = io.BytesIO()
+        np.lib.format.write_array_header_1_0(buffer, header)
+        if len(buffer.getvalue()) != data_offset:
+            raise ValueError(f"The header of {path} cannot be resized in place")
+        f.seek(0)
+        f.write(buffer.getvalue())
+        f.truncate(data_offset + n_frames * frame_bytes)
+
+
+class HDF5FrameWriter:
+    """Write frames into a chunked HDF5 dataset "frames", optionally compressed
+
+    Chunks hold about 1 MiB of rows of a single frame, so a frame is read back on its own and
+    written band by band without recompressing it. Needs h5py. The dataset has the fps and the
+    channel order (BGR or gray) as attributes, and is resized to the frames written when closed.
+    With start > 0 the existing dataset is written from frame start on, to resume a run.
+    """
+    def __init__(self, path, n_frames, fps=None, compression="lzf", start=0):
+        try:
+            import h5py
+        except ImportError as e:
+            raise ImportError("Writing HDF5 frames requires h5py (pip install h5py)") from e
+        self.path = path
+        self.n_frames = n_frames
+        self.fps = fps
+        self.compression = compression
+        self.count = start
+        self._file = h5py.File(path, "a" if start else "w")
+        self._dataset = None
+        if start:
+            self._dataset = self._file["frames"]
+            self._dataset.resize(n_frames, axis=0)
+
+    def _open(self, shape, dtype):
+        shape = tuple(shape)
+        rows = max(1, min(shape[0], 2 ** 20 // (int(np.prod(shape[1:])) * np.dtype(dtype).itemsize)))
+        self._dataset = self._file.create_dataset(
+            "frames", shape=(self.n_frames,) + shape, maxshape=(None,) + shape, dtype=dtype,
+            chunks=(1, rows) + shape[1:], compression=self.compression)
+        self._dataset.attrs["channels"] = "BGR" if len(shape) == 3 else "gray"
+        if self.fps is not None:
+            self._dataset.attrs["fps"] = self.fps
+
+    def write(self, frame):
+        if self._dataset is None:
+            self._open(frame.shape, frame.dtype)
+        self._dataset[self.count] = frame
+        self.count += 1
+
+    def write_bands(self, bands, shape, dtype):
+        """Write a frame of the given shape from consecutive bands of rows"""
+        if self._dataset is None:
+            self._open(shape, dtype)
+        row = 0
+        for band in bands:
+            self._dataset[self.count, row:row + len(band)] = band
+            row += len(band)
+        self.count += 1
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._dataset is not None and self.count < self.n_frames:
+            self._dataset.resize(self.count, axis=0)
+        self._file.close()
+        self._file = None
+
+
+def open_frame_store(path, n_frames, fps=None, start=0):
+    """Return the frame store writer of path, according to its .npy or .h5 extension
+
+    start > 0 continues an existing store whose first start frames were written by an interrupted run.
+    """
+    if os.path.splitext(path)[1].lower() == ".npy":
+        return NpyFrameWriter(path, n_frames, start)
+    return HDF5FrameWriter(path, n_frames, fps, start=start)
+
+
+def load_frames(path):
+    """Open a frame store for random access: a read-only memory map (.npy) or an h5py dataset (.h5)
+
+    Both are indexed by frame, store[k] being frame k as written by the generator.
+    """
+    if os.path.splitext(path)[1].lower() == ".npy":
+        return np.load(path, mmap_mode="r")
+    import h5py
+    return h5py.File(path, "r")["frames"]
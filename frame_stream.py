@@ -0,0 +1,52 @@
+import queue
+import threading
+
+_END = object()
+
+
+def _put(items, item, stop):
+    """Put item on the queue unless stop is set first, returning whether it was put"""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def prefetch_iter(iterable, size):
+    """Yield the items of iterable while a background thread produces up to size items ahead
+
+    Exceptions raised while producing are re-raised in the consumer. Closing the returned
+    generator, e.g. by leaving a for loop early, stops the producer and closes iterable.
+    """
+    items = queue.Queue(maxsize=max(1, size))
+    stop = threading.Event()
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not _put(items, (item, None), stop):
+                    return
+            _put(items, (_END, None), stop)
+        except BaseException as e:
+            _put(items, (_END, e), stop)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
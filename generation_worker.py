@@ -0,0 +1,163 @@
+import os
+import time
+import threading
+import traceback
+from collections import deque
+import numpy as np
+
+
+class GenerationCancelled(Exception):
+    """Raised from the progress callback to stop a job that was cancelled"""
+
+
+class GenerationJob:
+    """A queued generation run and its live progress"""
+    def __init__(self, job_id, script, params):
+        self.id = job_id
+        self.script = script
+        self.params = params
+        self.status = "queued"
+        self.frame = 0
+        self.n_frames = 0
+        self.fps = 0.0
+        self.message = ""
+        self.started = None
+        self.cancel_event = threading.Event()
+
+    def summary(self):
+        """Return a one-line description of the job for the status area"""
+        line = f"#{self.id} {self.script}: {self.status}"
+        if self.status == "running" or self.frame:
+            line += f" {self.frame}/{self.n_frames} frames ({self.fps:.1f} frames/s)"
+        if self.message:
+            line += f" - {self.message}"
+        return line
+
+
+def run_ipi_job(params, progress, job_id):
+    """Generate an IPI video in-process from CircleImageCreator keyword arguments
+
+    The PNG frames go to a job_<id> folder inside save_path, removed once it is empty again,
+    so jobs running at the same time never share frame files.
+    """
+    from IPI_generator import CircleImageCreator
+    creator = CircleImageCreator(**params)
+    creator.save_path = os.path.join(creator.save_path, f"job_{job_id}")
+    os.makedirs(creator.save_path, exist_ok=True)
+    ext = creator.create_images(progress=progress)
+    if creator.make_video and not creator.stream_video:
+        creator.make_video_file(ext)
+    if not os.listdir(creator.save_path):
+        os.rmdir(creator.save_path)
+    return f"{creator.video_file_path(ext)} written"
+
+
+def run_bubble_job(params, progress, job_id):
+    """Generate a bubble video in-process from generate_bubble_video keyword arguments
+
+    An unseeded job gets a fresh seed, so it draws from its own stream and never from the
+    global np.random that other jobs and the preview share.
+    """
+    from bubble_generator import generate_bubble_video
+    params = dict(params)
+    if params.get("seed") is None:
+        params["seed"] = int(np.random.SeedSequence().entropy % 2 ** 32)
+    generate_bubble_video(progress=progress, **params)
+    return f"{params.get('video_path')} written (seed {params['seed']})"
+
+
+JOB_RUNNERS = {
+    "IPI_generator.py": run_ipi_job,
+    "bubble_generator.py": run_bubble_job,
+}
+
+
+class GenerationWorker:
+    """Long-lived worker running generation jobs in this process, up to max_concurrent at a time
+
+    The generator modules are imported once, by the first job that needs them. on_update is
+    called with the job whenever its state changes and at most every update_interval seconds
+    while it is rendering frames.
+    """
+    def __init__(self, max_concurrent=1, on_update=None, update_interval=0.1):
+        self.max_concurrent = max_concurrent
+        self.on_update = on_update
+        self.update_interval = update_interval
+        self.jobs = []
+        self._queue = deque()
+        self._running = 0
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def submit(self, script, params):
+        """Queue a job and return it"""
+        with self._lock:
+            job = GenerationJob(self._next_id, script, params)
+            self._next_id += 1
+            self.jobs.append(job)
+            self._queue.append(job)
+        self._notify(job)
+        self._dispatch()
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; running jobs stop after their current frame"""
+        for job in self.jobs:
+            if job.id == job_id and job.status in ("queued", "running"):
+                job.cancel_event.set()
+                with self._lock:
+                    if job in self._queue:
+                        self._queue.remove(job)
+                        job.status = "cancelled"
+                self._notify(job)
+                return True
+        return False
+
+    def set_max_concurrent(self, max_concurrent):
+        self.max_concurrent = max(1, max_concurrent)
+        self._dispatch()
+
+    def active_jobs(self):
+        return [job for job in self.jobs if job.status in ("queued", "running")]
+
+    def _dispatch(self):
+        with self._lock:
+            while self._queue and self._running < self.max_concurrent:
+                job = self._queue.popleft()
+                job.status = "running"
+                self._running += 1
+                threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _notify(self, job):
+        if self.on_update is not None:
+            self.on_update(job)
+
+    def _run(self, job):
+        job.started = time.perf_counter()
+        last_update = [0.0]
+        self._notify(job)
+
+        def progress(frame, n_frames):
+            if job.cancel_event.is_set():
+                raise GenerationCancelled()
+            now = time.perf_counter()
+            job.frame, job.n_frames = frame, n_frames
+            job.fps = frame / max(now - job.started, 1e-9)
+            if now - last_update[0] >= self.update_interval or frame == n_frames:
+                last_update[0] = now
+                self._notify(job)
+
+        try:
+            job.message = JOB_RUNNERS[job.script](job.params, progress, job.id)
+            job.status = "done"
+        except GenerationCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.message = f"{e.__class__.__name__}: {e}"
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._notify(job)
+            self._dispatch()
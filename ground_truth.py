@@ -0,0 +1,140 @@
+import os
+import csv
+import numpy as np
+
+FORMATS = ("csv", "npz", "parquet")
+
+
+def ground_truth_format(path):
+    """Return the ground-truth format implied by a file extension"""
+    fmt = os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported ground truth format {fmt!r} for {path}, expected one of {FORMATS}")
+    return fmt
+
+
+class GroundTruthWriter:
+    """Buffer per-frame ground-truth records in preallocated columns and write them in chunks
+
+    columns is a list of (name, dtype) pairs. The format follows the file extension: CSV
+    (appended chunk by chunk, header first), Parquet (one row group per chunk, needs pyarrow)
+    or compressed NPZ (one array per column, written when the writer is closed).
+    A CSV file can be continued from an offset returned by tell, to resume an interrupted run.
+    """
+    def __init__(self, path, columns, chunk_rows=65536, offset=None):
+        self.path = path
+        self.fmt = ground_truth_format(path)
+        self.columns = [(name, np.dtype(dtype)) for name, dtype in columns]
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self._buffers = {name: np.empty(chunk_rows, dtype) for name, dtype in self.columns}
+        self._size = 0
+        self._chunks = []
+        self._file = None
+        self._csv_writer = None
+        self._parquet_writer = None
+        if offset is not None and self.fmt != "csv":
+            raise ValueError(f"Only CSV ground truth can be resumed, not {self.fmt}")
+        if self.fmt == "csv":
+            if offset is None:
+                self._file = open(path, mode='w', newline='')
+            else:
+                self._file = open(path, mode='r+', newline='')
+                self._file.seek(offset)
+                self._file.truncate()
+            self._csv_writer = csv.writer(self._file)
+            if offset is None:
+                self._csv_writer.writerow([name for name, _ in self.columns])
+        elif self.fmt == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError as e:
+                raise ImportError("Writing Parquet ground truth requires pyarrow (pip install pyarrow)") from e
+            self._pyarrow = pyarrow
+            self._parquet_writer = pyarrow.parquet.ParquetWriter(
+                path, pyarrow.schema([(name, pyarrow.from_numpy_dtype(dtype) if dtype.kind != "U" else pyarrow.string())
+                                      for name, dtype in self.columns]))
+
+    def append(self, **values):
+        """Append one record per object; scalar values (e.g. the frame index) are broadcast"""
+        n = max((np.size(v) for v in values.values() if np.ndim(v) > 0), default=1)
+        if n == 0:
+            return
+        if self._size + n > self.chunk_rows:
+            self.flush()
+        if n > self.chunk_rows:
+            self._write({name: np.broadcast_to(np.asarray(values[name], dtype), n) for name, dtype in self.columns})
+            return
+        for name, _ in self.columns:
+            self._buffers[name][self._size:self._size + n] = values[name]
+        self._size += n
+
+    def flush(self):
+        """Write the buffered records"""
+        if self._size:
+            self._write({name: buffer[:self._size] for name, buffer in self._buffers.items()})
+            self._size = 0
+
+    def tell(self):
+        """Flush the buffered records and return the CSV file offset, to resume writing from later"""
+        if self.fmt != "csv":
+            raise ValueError(f"Only CSV ground truth can be resumed, not {self.fmt}")
+        self.flush()
+        self._file.flush()
+        return self._file.tell()
+
+    def _write(self, chunk):
+        self.rows += len(next(iter(chunk.values())))
+        if self.fmt == "csv":
+            self._csv_writer.writerows(zip(*(chunk[name].tolist() for name, _ in self.columns)))
+        elif self.fmt == "parquet":
+            self._parquet_writer.write_table(self._pyarrow.table({name: chunk[name] for name, _ in self.columns}))
+        else:
+            self._chunks.append({name: column.copy() for name, column in chunk.items()})
+
+    def close(self):
+        self.flush()
+        if self.fmt == "csv":
+            self._file.close()
+        elif self.fmt == "parquet":
+            self._parquet_writer.close()
+        else:
+            np.savez_compressed(self.path, **{
+                name: np.concatenate([chunk[name] for chunk in self._chunks]) if self._chunks else np.empty(0, dtype)
+                for name, dtype in self.columns})
+            self._chunks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_ground_truth(path):
+    """Read a ground-truth file written by GroundTruthWriter into a dict of column arrays"""
+    fmt = ground_truth_format(path)
+    if fmt == "npz":
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    if fmt == "parquet":
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path)
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    columns = {}
+    for i, name in enumerate(header):
+        values = [row[i] for row in rows]
+        for dtype in (np.int64, np.float64):
+            try:
+                columns[name] = np.array(values, dtype=dtype)
+                break
+            except ValueError:
+                continue
+        else:
+            columns[name] = np.array(values)
+    return columns
@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+import cv2
+import numpy as np
+from backgrounds import open_background_source
+
+# Size (width, height) of the preview strip, split into one cell per previewed frame
+PREVIEW_SIZE = (768, 512)
+PREVIEW_FRAMES = 3
+# Seed of the preview when the run itself is unseeded
+PREVIEW_SEED = 0
+
+_backgrounds = {}
+
+
+def preview_indices(n_frames, count=PREVIEW_FRAMES):
+    """Return count frame indices spread evenly over the first n_frames frames"""
+    return sorted(set(np.linspace(0, max(n_frames, 1) - 1, count).round().astype(int).tolist()))
+
+
+def preview_background(path, resolution, grayscale=False, dtype=np.uint8):
+    """Return a background source at the preview resolution, kept open between previews"""
+    key = (path, tuple(resolution), grayscale, np.dtype(dtype),
+           os.path.getmtime(path) if path and os.path.exists(path) else None)
+    if key not in _backgrounds:
+        for source in _backgrounds.values():
+            if source is not None:
+                source.close()
+        _backgrounds.clear()
+        _backgrounds[key] = open_background_source(path, resolution, False, grayscale, dtype)
+    return _backgrounds[key]
+
+
+def fit_scale(size, cell_size):
+    """Return the scale that fits a (width, height) frame into a preview cell"""
+    return min(cell_size[0] / size[0], cell_size[1] / size[1])
+
+
+def ipi_preview(params, cell_size, count=PREVIEW_FRAMES):
+    """Render IPI preview frames from CircleImageCreator keyword arguments"""
+    from IPI_generator import CircleImageCreator
+    params = dict(params)
+    if params.get("seed") is None:
+        params["seed"] = PREVIEW_SEED
+    creator = CircleImageCreator(**params)
+    width, height = creator.background_resolution
+    scale = fit_scale((height, width) if creator.apply_rotation else (width, height), cell_size)
+    background_source = None
+    if creator.use_background_image:
+        background_source = preview_background(
+            creator.path, tuple(max(1, round(size * scale)) for size in creator.background_resolution),
+            creator.grayscale, creator.dtype)
+    # Frames from the first second only: the particles are simulated up to the last previewed frame
+    return creator.render_preview(preview_indices(min(creator.n_pic, creator.fps), count), scale, background_source)
+
+
+def bubble_preview(params, cell_size, count=PREVIEW_FRAMES):
+    """Render bubble preview frames from generate_bubble_video keyword arguments"""
+    from bubble_generator import BubbleSimulation
+    width, height, fps = params["width"], params["height"], params["fps"]
+    total_frames = fps * params["duration"]
+    # Its own stream, as generation jobs draw their bubbles on other threads meanwhile
+    simulation = BubbleSimulation(width, height, fps, total_frames, max(1, int(fps * params["spawn_interval"])),
+                                  params["large_radius_probability"], params["radius_decrease_factor"],
+                                  np.random.RandomState(PREVIEW_SEED))
+    scale = fit_scale((width, height), cell_size)
+    size = (max(1, round(height * scale)), max(1, round(width * scale)))
+    frames = preview_indices(total_frames, count)
+    images = []
+    for frame_idx in frames:
+        ids, x, y, radius = simulation.state(frame_idx)
+        frame = np.full(size, 255, dtype=np.uint8)
+        for bubble_x, bubble_y, bubble_radius in zip(x.tolist(), y.tolist(), radius.tolist()):
+            cv2.circle(frame, (round(bubble_x * scale), round(bubble_y * scale)),
+                       max(1, round(bubble_radius * scale)), 0, -1)
+        images.append(frame)
+    return images
+
+
+PREVIEWS = {
+    "IPI_generator.py": ipi_preview,
+    "bubble_generator.py": bubble_preview,
+}
+
+
+def render_preview(script, params, size=PREVIEW_SIZE, count=PREVIEW_FRAMES):
+    """Render a preview strip and return it as a flat RGBA float32 array, as used by GUI textures"""
+    cell_size = (size[0] // count, size[1])
+    images = PREVIEWS[script](params, cell_size, count)
+    strip = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    for i, image in enumerate(images):
+        if image.dtype == np.uint16:
+            image = (image >> 8).astype(np.uint8)
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        image = image[:cell_size[1], :cell_size[0]]
+        # Center each frame in its cell
+        y0 = (cell_size[1] - image.shape[0]) // 2
+        x0 = i * cell_size[0] + (cell_size[0] - image.shape[1]) // 2
+        strip[y0:y0 + image.shape[0], x0:x0 + image.shape[1]] = image
+    rgba = np.empty((size[1], size[0], 4), dtype=np.float32)
+    rgba[..., :3] = strip[..., ::-1] / 255
+    rgba[..., 3] = 1
+    return rgba.ravel()
+
+
+class PreviewScheduler:
+    """Render previews on one background thread, always from the latest request
+
+    Requests that arrive while a preview is rendering replace each other, so a slider drag
+    never queues stale renders: once the current render finishes, only the newest parameters
+    are rendered. Each render waits delay seconds first, to let a burst of events settle.
+    on_result is called with the rendered preview, or on_error with the exception.
+    """
+    def __init__(self, render, on_result, on_error=None, delay=0.03):
+        self.render = render
+        self.on_result = on_result
+        self.on_error = on_error
+        self.delay = delay
+        self._pending = None
+        self._condition = threading.Condition()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def request(self, *args):
+        """Ask for a preview of args, replacing any request not yet started"""
+        with self._condition:
+            self._pending = args
+            self._condition.notify()
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+            time.sleep(self.delay)
+            with self._condition:
+                args, self._pending = self._pending, None
+            try:
+                result = self.render(*args)
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+                continue
+            self.on_result(result)
@@ -0,0 +1,82 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+
+class StageTimer:
+    """Record the wall time of named stages for every frame of a run
+
+    Stages are timed with `with timer.stage("blur"):` and a frame is closed with end_frame.
+    A disabled timer does nothing, so instrumented code can keep the calls in place.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.frames = []
+        self._current = {}
+        self._start = time.perf_counter()
+
+    def stage(self, name):
+        if not self.enabled:
+            return nullcontext()
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._current[name] = self._current.get(name, 0.0) + time.perf_counter() - start
+
+    def timed_iter(self, name, iterable):
+        """Yield from iterable, timing each step under the given stage name"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def end_frame(self):
+        if self.enabled:
+            self.frames.append(self._current)
+            self._current = {}
+
+    def report(self):
+        """Return per-stage totals and per-frame percentiles (in milliseconds) as a dict"""
+        wall_time = time.perf_counter() - self._start
+        stages = {}
+        names = sorted({name for frame in self.frames for name in frame})
+        for name in names:
+            times = np.array([frame.get(name, 0.0) for frame in self.frames]) * 1000
+            stages[name] = {
+                "total_s": float(times.sum() / 1000),
+                "mean_ms": float(times.mean()),
+                "p50_ms": float(np.percentile(times, 50)),
+                "p95_ms": float(np.percentile(times, 95)),
+                "p99_ms": float(np.percentile(times, 99)),
+                "max_ms": float(times.max()),
+            }
+        return {
+            "frames": len(self.frames),
+            "wall_time_s": wall_time,
+            "fps": len(self.frames) / wall_time if wall_time > 0 else 0.0,
+            "stages": stages,
+        }
+
+    def write_json(self, path):
+        report = self.report()
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        return report
+
+
+def print_report(report):
+    """Print a stage table of a StageTimer report"""
+    print(f"{report['frames']} frames in {report['wall_time_s']:.2f} s ({report['fps']:.1f} frames/s)")
+    print(f"{'stage':<14}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, s in sorted(report["stages"].items(), key=lambda item: -item[1]["total_s"]):
+        print(f"{name:<14}{s['total_s']:>10.3f}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}")
@@ -0,0 +1,182 @@
+import cv2
+import numpy as np
+
+# Bank tiles hold standard normal draws in fixed point (z * 2**Z_BITS); noise amplitudes are
+# scaled by 2**SIGMA_BITS, so their product is shifted right by both to get grey levels
+Z_BITS = 8
+SIGMA_BITS = 4
+
+
+class SensorNoise:
+    """Camera sensor noise added to rendered frames: gain, shot, read and fixed-pattern noise
+
+    A pixel of value v becomes gain * v plus Gaussian noise of variance
+    shot_noise * gain * v + read_noise ** 2 (the shot noise grows with the signal, the read
+    noise does not), plus a fixed-pattern offset of standard deviation fixed_pattern_noise that
+    is the same in every frame. Values are in grey levels of the frame and clipped to its range.
+
+    Instead of drawing fresh random fields every frame, the frame is cut into tile_size blocks
+    and each block takes a window at a random offset in one of bank_size precomputed tiles of
+    normal draws. Read and fixed-pattern noise come from copies of the bank scaled to grey
+    levels once, so they are plain saturating integer adds; shot noise looks up the amplitude
+    of every pixel once per frame (cv2.LUT for 8-bit frames) and scales the bank window by it.
+    Gain alone is a single lookup. The choices depend only on seed, the frame index and the
+    block position, so a frame gets the same noise whether it is processed whole, in bands of
+    rows, on another process or after resuming a run. Banks are built on first use, not pickled.
+    """
+    def __init__(self, seed, gain=1.0, shot_noise=0.0, read_noise=0.0, fixed_pattern_noise=0.0,
+                 bank_size=8, tile_size=256):
+        if gain <= 0 or min(shot_noise, read_noise, fixed_pattern_noise) < 0:
+            raise ValueError("gain must be positive and the noise levels non-negative")
+        self.seed = seed
+        self.gain = gain
+        self.shot_noise = shot_noise
+        self.read_noise = read_noise
+        self.fixed_pattern_noise = fixed_pattern_noise
+        self.bank_size = bank_size
+        self.tile_size = tile_size
+        self._banks = {}
+        self._luts = {}
+        self._buffers = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_banks"], state["_luts"], state["_buffers"] = {}, {}, {}
+        return state
+
+    def bank(self, channels, sigma=None):
+        """Return the noise tiles for frames of channels channels (0 for single-channel frames)
+
+        The tiles hold z * 2**Z_BITS, or z * sigma in grey levels when sigma is given.
+        """
+        bank = self._banks.get((channels, sigma))
+        if bank is None:
+            if sigma is None:
+                # Tiles are twice tile_size wide, so any tile_size window at an offset below tile_size fits
+                shape = (self.bank_size, 2 * self.tile_size, 2 * self.tile_size) + ((channels,) if channels else ())
+                z = np.random.default_rng([self.seed, 2, channels]).standard_normal(shape, dtype=np.float32)
+                bank = np.clip(np.rint(z * 2 ** Z_BITS), -2 ** 15, 2 ** 15 - 1).astype(np.int16)
+            else:
+                z = self.bank(channels).astype(np.float32)
+                bank = np.clip(np.rint(z * (sigma * 2.0 ** -Z_BITS)), -2 ** 15, 2 ** 15 - 1).astype(np.int16)
+            self._banks[(channels, sigma)] = bank
+        return bank
+
+    def luts(self, dtype):
+        """Return the gained value, and the gained value and noise amplitude (scaled by
+        2**SIGMA_BITS) as working integers, of every pixel value
+
+        The working integers are int16 for 8-bit frames with a gain below 64, else int32.
+        """
+        luts = self._luts.get(dtype)
+        if luts is None:
+            maxval = np.iinfo(dtype).max
+            values = np.arange(maxval + 1, dtype=np.float64)
+            work = np.int16 if maxval == 255 and self.gain < 64 else np.int32
+            limit = np.iinfo(work).max
+            gained = np.clip(np.rint(self.gain * values), 0, maxval).astype(dtype)
+            mean = np.clip(np.rint(self.gain * values), 0, limit).astype(work)
+            sigma = np.sqrt(self.shot_noise * self.gain * values + self.read_noise ** 2)
+            sigma = np.clip(np.rint(sigma * 2 ** SIGMA_BITS), 0, limit).astype(work)
+            luts = gained, mean, sigma
+            self._luts[dtype] = luts
+        return luts
+
+    def _buffer(self, name, shape, dtype):
+        """Return the reused buffer called name, reallocated when the frame shape or type changes"""
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buffer
+
+    @staticmethod
+    def lookup(lut, image, out=None):
+        """Map every pixel of image through lut, with cv2.LUT for 8-bit images"""
+        if image.dtype == np.uint8:
+            return cv2.LUT(image, lut, dst=out)
+        if out is None:
+            out = np.empty(image.shape, dtype=lut.dtype)
+        return np.take(lut, image, out=out, mode="clip")
+
+    def _choices(self, key, row, n_columns):
+        """Return the bank tile and window offsets of the blocks of a block row"""
+        rng = np.random.default_rng(key + [row])
+        return (rng.integers(0, self.bank_size, n_columns), rng.integers(0, self.tile_size, n_columns),
+                rng.integers(0, self.tile_size, n_columns))
+
+    def apply(self, image, frame, row=0, out=None):
+        """Add the noise of a frame to image, the rows of the frame from row on, and return the result
+
+        The result is written to out if given (an array like image), else into image itself.
+        """
+        out = image if out is None else out
+        dtype = np.dtype(image.dtype).type
+        gained, mean_lut, sigma_lut = self.luts(dtype)
+        if not (self.shot_noise or self.read_noise or self.fixed_pattern_noise):
+            return self.lookup(gained, image, out)
+        channels = image.shape[2] if image.ndim == 3 else 0
+        depth = cv2.CV_8U if dtype == np.uint8 else cv2.CV_16U
+        work = cv2.CV_16S if mean_lut.dtype == np.int16 else cv2.CV_32S
+        # Blocks are processed one at a time through block-sized buffers that stay in cache; each
+        # block is read before it is written, so out may be image
+        tile = self.tile_size
+        block_shape = (tile, tile) + image.shape[2:]
+        signal = None if self.gain == 1 else self._buffer("signal", block_shape, mean_lut.dtype)
+        noise = None
+        if self.shot_noise or (self.read_noise and self.fixed_pattern_noise):
+            noise = self._buffer("noise", block_shape, mean_lut.dtype)
+        if self.shot_noise:
+            # The amplitude includes the read noise, as their variances add up
+            bank = self.bank(channels)
+        elif self.read_noise:
+            bank = self.bank(channels, self.read_noise)
+        else:
+            bank = None
+        fixed_bank = self.bank(channels, self.fixed_pattern_noise) if self.fixed_pattern_noise else None
+        scale = 2.0 ** -(Z_BITS + SIGMA_BITS)
+        height, width = image.shape[:2]
+        n_columns = (width + tile - 1) // tile
+        for block_row in range(row // tile, (row + height + tile - 1) // tile):
+            y0, y1 = max(block_row * tile, row) - row, min((block_row + 1) * tile, row + height) - row
+            dy = y0 + row - block_row * tile
+            frame_choices = self._choices([self.seed, 1, frame], block_row, n_columns) if bank is not None else None
+            fixed_choices = self._choices([self.seed, 0], block_row, n_columns) if fixed_bank is not None else None
+            for column in range(n_columns):
+                x0, x1 = column * tile, min((column + 1) * tile, width)
+                h, w = y1 - y0, x1 - x0
+                z = fixed = None
+                if frame_choices is not None:
+                    index, oy, ox = (choice[column] for choice in frame_choices)
+                    z = bank[index, oy + dy:oy + dy + h, ox:ox + w]
+                if fixed_choices is not None:
+                    index, oy, ox = (choice[column] for choice in fixed_choices)
+                    fixed = fixed_bank[index, oy + dy:oy + dy + h, ox:ox + w]
+                pixels = image[y0:y1, x0:x1]
+                if noise is not None:
+                    n = noise[:h, :w]
+                    if self.shot_noise:
+                        self.lookup(sigma_lut, pixels, n)
+                        cv2.multiply(n, z, dst=n, scale=scale, dtype=work)
+                        if fixed is not None:
+                            cv2.add(n, fixed, dst=n, dtype=work)
+                    else:
+                        cv2.add(z, fixed, dst=n, dtype=work)
+                else:
+                    n = z if z is not None else fixed
+                if signal is not None:
+                    pixels = self.lookup(mean_lut, pixels, signal[:h, :w])
+                # Saturating add: clips to the range of the frame on the way out
+                cv2.add(pixels, n, dst=out[y0:y1, x0:x1], dtype=depth)
+        return out
+
+
+def sensor_noise_enabled(gain=1.0, shot_noise=0.0, read_noise=0.0, fixed_pattern_noise=0.0):
+    """Return whether these sensor settings change the frames"""
+    return gain != 1 or bool(shot_noise or read_noise or fixed_pattern_noise)
+
+
+def make_sensor_noise(seed, gain=1.0, shot_noise=0.0, read_noise=0.0, fixed_pattern_noise=0.0):
+    """Return the SensorNoise of these settings, or None when they leave frames unchanged"""
+    if not sensor_noise_enabled(gain, shot_noise, read_noise, fixed_pattern_noise):
+        return None
+    return SensorNoise(seed, gain, shot_noise, read_noise, fixed_pattern_noise)
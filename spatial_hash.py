@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class SpatialHash:
+    """Uniform grid over particle disks, to test a new disk against its neighbours only
+
+    Two disks of radii r1 and r2 are compatible when their centres are at least
+    r1 + r2 + min_separation - 2 * max_overlap * min(r1, r2) apart: min_separation is the gap
+    required between their edges (negative to allow some overlap in pixels) and max_overlap the
+    fraction of the smaller diameter they may overlap by. Cells are as large as that distance
+    can get for radii up to max_radius, so a query only visits the 3x3 cells around a disk.
+    """
+    def __init__(self, max_radius, min_separation=0.0, max_overlap=0.0):
+        self.min_separation = min_separation
+        self.max_overlap = max_overlap
+        self.cell_size = max(1.0, 2 * max_radius + min_separation)
+        self.clear()
+
+    def clear(self):
+        self.cells = {}
+        self.x = []
+        self.y = []
+        self.radius = []
+
+    def __len__(self):
+        return len(self.x)
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def build(self, x, y, radius):
+        """Replace the content of the grid with the given disks"""
+        self.clear()
+        for args in zip(np.asarray(x).tolist(), np.asarray(y).tolist(), np.asarray(radius).tolist()):
+            self.insert(*args)
+
+    def insert(self, x, y, radius):
+        self.cells.setdefault(self._cell(x, y), []).append(len(self.x))
+        self.x.append(x)
+        self.y.append(y)
+        self.radius.append(radius)
+
+    def min_distance(self, r1, r2):
+        """Return the smallest distance allowed between the centres of two disks"""
+        return r1 + r2 + self.min_separation - 2 * self.max_overlap * min(r1, r2)
+
+    def is_clear(self, x, y, radius):
+        """Return whether a disk is compatible with every disk of the grid"""
+        cx, cy = self._cell(x, y)
+        for i in (cx - 1, cx, cx + 1):
+            for j in (cy - 1, cy, cy + 1):
+                for k in self.cells.get((i, j), ()):
+                    distance = self.min_distance(radius, self.radius[k])
+                    if distance > 0 and (self.x[k] - x) ** 2 + (self.y[k] - y) ** 2 < distance ** 2:
+                        return False
+        return True
@@ -1,7 +1,8 @@
 import dearpygui.dearpygui as dpg
-import subprocess
-import threading
 import os
+import numpy as np
+from generation_worker import GenerationWorker
+from preview import PREVIEW_SIZE, PreviewScheduler, render_preview
 
 # Get the directory of the script
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -17,13 +18,26 @@ user_params = {
     "video_duration": 2,
     "n_circles": 20,
     "n_blobs": 0,
+    "overlap_control": False,
+    "min_separation": 0.0,
+    "max_overlap": 0.0,
     "apply_blur": False,
     "blur_radius": 5,
+    "dirty_blur": False,
     "apply_rotation": True,
+    "grayscale": False,
+    "bit_depth": "8",
     "use_background_image": False,
     "background_image_path": os.path.join(script_dir, "AVG_bg.tif"),
     "save_path": os.path.join(script_dir, "Images"),
     "output_video_path": script_dir,
+    "stream_video": False,
+    "n_workers": 1,
+    "seed": -1,
+    "live_preview": True,
+    # Job queue
+    "max_concurrent_jobs": 1,
+    "cancel_job_id": 0,
     # Bubble simulation parameters
     "bubble_width": 1000,
     "bubble_height": 1000,
@@ -48,6 +62,7 @@ def update_param(sender, app_data, user_data):
     param_name = user_data
     user_params[param_name] = app_data
     update_ui_visibility()
+    request_preview()
 
 def update_ui_visibility():
     """Show or hide UI elements based on the selected script."""
@@ -75,59 +90,90 @@ def show_help():
     except FileNotFoundError:
         dpg.set_value("status", f"Error: Could not find user_manual.txt at {manual_path}")
 
-def generate_video():
-    """Run the selected script with the current parameters."""
-    script_path = os.path.join(script_dir, user_params["script"])
-    command = ["python", script_path]
+def job_params():
+    """Return the generator keyword arguments for the current parameters."""
     if user_params["script"] == "IPI_generator.py":
-        command.extend([
-            "--rmin", str(user_params["rmin"]),
-            "--rmax", str(user_params["rmax"]),
-            "--vitx", str(user_params["vitx"]),
-            "--vity", str(user_params["vity"]),
-            "--fps", str(user_params["fps"]),
-            "--video_duration", str(user_params["video_duration"]),
-            "--n_circles", str(user_params["n_circles"]),
-            "--n_blobs", str(user_params["n_blobs"]),
-            "--apply_blur", "1" if user_params["apply_blur"] else "0",
-            "--blur_radius", str(user_params["blur_radius"]),
-            "--apply_rotation", "1" if user_params["apply_rotation"] else "0",
-            "--use_background_image", "1" if user_params["use_background_image"] else "0",
-            "--background_image_path", user_params["background_image_path"],
-            "--save_path", user_params["save_path"],
-            "--output_video_path", user_params["output_video_path"],
-        ])
-    else:
-        command.extend([
-            "--width", str(user_params["bubble_width"]),
-            "--height", str(user_params["bubble_height"]),
-            "--fps", str(user_params["bubble_fps"]),
-            "--duration", str(user_params["bubble_duration"]),
-            "--spawn_interval", str(user_params["bubble_spawn_interval"]),
-            "--large_radius_probability", str(user_params["large_radius_probability"]),
-            "--radius_decrease_factor", str(user_params["radius_decrease_factor"]),
-            "--video_path", user_params["bubble_video_path"],
-            "--csv_path", user_params["bubble_csv_path"],
-        ])
-    dpg.set_value("status", "Generating video...")
-    dpg.set_value("log_window", "")
-    def run():
-        try:
-            result = subprocess.run(
-                command,
-                check=True,
-                text=True,
-                capture_output=True,
-                cwd=script_dir
-            )
-            dpg.set_value("log_window", result.stdout)
-            dpg.set_value("status", "Video generated successfully!")
-        except subprocess.CalledProcessError as e:
-            dpg.set_value("log_window", e.stderr)
-            dpg.set_value("status", "Error generating video.")
-    threading.Thread(target=run).start()
+        return {
+            "rmin": user_params["rmin"],
+            "rmax": user_params["rmax"],
+            "vitx": user_params["vitx"],
+            "vity": user_params["vity"],
+            "fps": user_params["fps"],
+            "video_duration": user_params["video_duration"],
+            "n_circles": user_params["n_circles"],
+            "n_blobs": user_params["n_blobs"],
+            "min_separation": user_params["min_separation"] if user_params["overlap_control"] else None,
+            "max_overlap": user_params["max_overlap"] if user_params["overlap_control"] else None,
+            "apply_blur": user_params["apply_blur"],
+            "blur_radius": user_params["blur_radius"],
+            "dirty_blur": user_params["dirty_blur"],
+            "apply_rotation": user_params["apply_rotation"],
+            "grayscale": user_params["grayscale"],
+            "bit_depth": int(user_params["bit_depth"]),
+            "use_background_image": user_params["use_background_image"],
+            "background_image_path": user_params["background_image_path"],
+            "save_path": user_params["save_path"],
+            "output_video_path": user_params["output_video_path"],
+            "stream_video": user_params["stream_video"],
+            "n_workers": user_params["n_workers"],
+            "seed": user_params["seed"] if user_params["seed"] >= 0 else None,
+        }
+    return {
+        "width": user_params["bubble_width"],
+        "height": user_params["bubble_height"],
+        "fps": user_params["bubble_fps"],
+        "duration": user_params["bubble_duration"],
+        "spawn_interval": user_params["bubble_spawn_interval"],
+        "large_radius_probability": user_params["large_radius_probability"],
+        "radius_decrease_factor": user_params["radius_decrease_factor"],
+        "video_path": user_params["bubble_video_path"],
+        "csv_path": user_params["bubble_csv_path"],
+    }
+
+def show_jobs(job):
+    """Refresh the status area from the worker's jobs (called from worker threads)."""
+    dpg.set_value("status", f"Status: {job.summary()}")
+    dpg.set_value("log_window", "\n".join(j.summary() for j in reversed(worker.jobs)))
+
+# Generation jobs run in this process, so the generators are imported only once
+worker = GenerationWorker(max_concurrent=user_params["max_concurrent_jobs"], on_update=show_jobs)
+
+def generate_video():
+    """Queue a generation job with the selected script and the current parameters."""
+    worker.submit(user_params["script"], job_params())
+
+def cancel_job():
+    """Cancel the job whose number is entered, or the most recent active job."""
+    job_id = user_params["cancel_job_id"]
+    if job_id <= 0 and worker.active_jobs():
+        job_id = worker.active_jobs()[-1].id
+    if not worker.cancel(job_id):
+        dpg.set_value("status", f"Status: no queued or running job #{job_id}")
+
+def show_preview(texture):
+    dpg.set_value("preview_texture", texture)
+    dpg.set_value("preview_status", "")
+
+def show_preview_error(error):
+    dpg.set_value("preview_status", f"Preview failed: {error.__class__.__name__}: {error}")
+
+# Previews render on their own thread from the latest parameters only
+previewer = PreviewScheduler(render_preview, show_preview, show_preview_error)
+
+def request_preview():
+    """Refresh the low-resolution preview of the current parameters, if enabled."""
+    if user_params["live_preview"]:
+        previewer.request(user_params["script"], job_params())
+
+def update_max_concurrent(sender, app_data, user_data):
+    update_param(sender, app_data, user_data)
+    worker.set_max_concurrent(app_data)
 
 def create_ui():
+    with dpg.texture_registry():
+        dpg.add_dynamic_texture(PREVIEW_SIZE[0], PREVIEW_SIZE[1],
+                                np.zeros(PREVIEW_SIZE[0] * PREVIEW_SIZE[1] * 4, dtype=np.float32),
+                                tag="preview_texture")
     with dpg.window(label="Video Generator", width=800, height=900, no_scrollbar=True):
         # Create a drawing for the title
         with dpg.drawlist(width=770, height=100):  # Increased height from 60 to 80
@@ -228,6 +274,38 @@ def create_ui():
                 callback=update_param,
                 user_data="n_blobs"
             )
+            dpg.add_checkbox(
+                label="Control Overlap When Particles Spawn",
+                tag="overlap_control_checkbox",
+                default_value=user_params["overlap_control"],
+                callback=update_param,
+                user_data="overlap_control"
+            )
+            dpg.add_input_float(
+                label="Minimum Separation (px)",
+                tag="min_separation_input",
+                default_value=user_params["min_separation"],
+                callback=update_param,
+                user_data="min_separation"
+            )
+            dpg.add_slider_float(
+                label="Maximum Overlap (fraction)",
+                tag="max_overlap_slider",
+                min_value=0.0,
+                max_value=1.0,
+                default_value=user_params["max_overlap"],
+                callback=update_param,
+                user_data="max_overlap"
+            )
+            dpg.add_input_int(
+                label="Random Seed (-1 = random)",
+                tag="seed_input",
+                min_value=-1,
+                min_clamped=True,
+                default_value=user_params["seed"],
+                callback=update_param,
+                user_data="seed"
+            )
             dpg.add_text("Background Image:")
             dpg.add_checkbox(
                 label="Use Background Image",
@@ -260,6 +338,13 @@ def create_ui():
                 callback=update_param,
                 user_data="blur_radius"
             )
+            dpg.add_checkbox(
+                label="Blur Only Around Objects (static background)",
+                tag="dirty_blur_checkbox",
+                default_value=user_params["dirty_blur"],
+                callback=update_param,
+                user_data="dirty_blur"
+            )
             dpg.add_checkbox(
                 label="Apply Rotation",
                 tag="rotation_checkbox",
@@ -267,6 +352,24 @@ def create_ui():
                 callback=update_param,
                 user_data="apply_rotation"
             )
+            dpg.add_text("Output Format:")
+            with dpg.group(horizontal=True):
+                dpg.add_checkbox(
+                    label="Grayscale",
+                    tag="grayscale_checkbox",
+                    default_value=user_params["grayscale"],
+                    callback=update_param,
+                    user_data="grayscale"
+                )
+                dpg.add_combo(
+                    ["8", "16"],
+                    label="Bits per Channel",
+                    tag="bit_depth_combo",
+                    width=60,
+                    default_value=user_params["bit_depth"],
+                    callback=update_param,
+                    user_data="bit_depth"
+                )
             dpg.add_text("Paths:")
             dpg.add_input_text(
                 label="Save Path",
@@ -282,6 +385,23 @@ def create_ui():
                 callback=update_param,
                 user_data="output_video_path"
             )
+            dpg.add_checkbox(
+                label="Stream Video (no temporary PNG frames)",
+                tag="stream_video_checkbox",
+                default_value=user_params["stream_video"],
+                callback=update_param,
+                user_data="stream_video"
+            )
+            dpg.add_text("Performance:")
+            dpg.add_slider_int(
+                label="Render Worker Processes",
+                tag="n_workers_slider",
+                min_value=1,
+                max_value=32,
+                default_value=user_params["n_workers"],
+                callback=update_param,
+                user_data="n_workers"
+            )
         # Bubble Simulation Parameters
         with dpg.group(tag="bubble_parameters_group", show=False):
             dpg.add_text("Video Parameters:")
@@ -364,10 +484,36 @@ def create_ui():
                 callback=update_param,
                 user_data="bubble_csv_path"
             )
-        dpg.add_button(
-            label="Generate Video",
-            callback=lambda: generate_video()
-        )
+        with dpg.group(horizontal=True):
+            dpg.add_button(
+                label="Generate Video",
+                callback=lambda: generate_video()
+            )
+            dpg.add_slider_int(
+                label="Concurrent Jobs",
+                tag="max_concurrent_jobs_slider",
+                min_value=1,
+                max_value=8,
+                width=150,
+                default_value=user_params["max_concurrent_jobs"],
+                callback=update_max_concurrent,
+                user_data="max_concurrent_jobs"
+            )
+        with dpg.group(horizontal=True):
+            dpg.add_button(
+                label="Cancel Job",
+                callback=lambda: cancel_job()
+            )
+            dpg.add_input_int(
+                label="Job # (0 = latest)",
+                tag="cancel_job_id_input",
+                min_value=0,
+                min_clamped=True,
+                width=150,
+                default_value=user_params["cancel_job_id"],
+                callback=update_param,
+                user_data="cancel_job_id"
+            )
         dpg.add_text("Status:", tag="status")
         dpg.add_input_text(
             tag="log_window",
@@ -376,11 +522,24 @@ def create_ui():
             width=-1,
             height=100
         )
+    with dpg.window(label="Preview", pos=(810, 0), width=PREVIEW_SIZE[0] + 20, height=PREVIEW_SIZE[1] + 80, no_scrollbar=True):
+        with dpg.group(horizontal=True):
+            dpg.add_checkbox(
+                label="Live Preview (reduced resolution)",
+                tag="live_preview_checkbox",
+                default_value=user_params["live_preview"],
+                callback=update_param,
+                user_data="live_preview"
+            )
+            dpg.add_text("", tag="preview_status")
+        dpg.add_image("preview_texture")
 
-dpg.create_context()
-create_ui()
-dpg.create_viewport(title="Video Generator", width=820, height=950)
-dpg.setup_dearpygui()
-dpg.show_viewport()
-dpg.start_dearpygui()
-dpg.destroy_context()
+if __name__ == '__main__':
+    dpg.create_context()
+    create_ui()
+    request_preview()
+    dpg.create_viewport(title="Video Generator", width=820 + PREVIEW_SIZE[0] + 30, height=950)
+    dpg.setup_dearpygui()
+    dpg.show_viewport()
+    dpg.start_dearpygui()
+    dpg.destroy_context()
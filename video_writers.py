@@ -0,0 +1,299 @@
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+
+# ffmpeg rawvideo pixel format of (channels, dtype) frames
+RAW_PIX_FMTS = {
+    (3, np.dtype(np.uint8)): "bgr24",
+    (1, np.dtype(np.uint8)): "gray",
+    (3, np.dtype(np.uint16)): "bgr48le",
+    (1, np.dtype(np.uint16)): "gray16le",
+}
+
+# Codecs of the ffmpeg encoders, with their default output pixel format
+VIDEO_CODECS = {"libx264": "yuv420p", "ffv1": "bgr0", "mjpeg": "yuvj420p"}
+
+# Containers ffmpeg can mux FFV1 into (not MP4)
+FFV1_CONTAINERS = (".mkv", ".avi", ".nut")
+
+
+def codec_args(codec, pix_fmt=None, quality=None):
+    """Return the ffmpeg output options of a codec
+
+    quality is the libx264 CRF (0-51, ffmpeg default 23) or the MJPEG q:v (2-31, default 3),
+    lower is better; FFV1 is lossless and ignores it.
+    """
+    args = ["-c:v", codec, "-pix_fmt", pix_fmt or VIDEO_CODECS.get(codec, "yuv420p")]
+    if codec == "ffv1":
+        # Version 3 supports slices, so a single encoder can use several threads
+        args += ["-level", "3"]
+    elif codec == "mjpeg":
+        args += ["-q:v", str(3 if quality is None else quality)]
+    elif quality is not None:
+        args += ["-crf", str(quality)]
+    return args
+
+
+def video_extension(codec):
+    """Return the default video file extension of a codec: Matroska for FFV1, else MP4"""
+    return ".mkv" if codec == "ffv1" else ".mp4"
+
+
+def check_container(path, codec):
+    """Raise ValueError, before anything is rendered, if codec cannot be written to the container of path"""
+    ext = os.path.splitext(path)[1].lower()
+    if codec == "ffv1" and ext not in FFV1_CONTAINERS:
+        raise ValueError(f"FFV1 video cannot be written to {ext or 'extensionless'} files, "
+                         f"use one of {', '.join(FFV1_CONTAINERS)}")
+
+
+def segment_ranges(n_frames, segment_frames):
+    """Split frames [0, n_frames) into (start, count) segments of segment_frames frames (one segment when 0)"""
+    if not segment_frames or segment_frames >= n_frames:
+        return [(0, n_frames)]
+    return [(start, min(segment_frames, n_frames - start)) for start in range(0, n_frames, segment_frames)]
+
+
+def segment_paths(path, n_segments, ext=".mkv"):
+    """Return the temporary segment files of a video, next to it"""
+    base = os.path.splitext(path)[0]
+    return [f"{base}.part{i:03d}{ext}" for i in range(n_segments)]
+
+
+def require_ffmpeg(purpose):
+    """Raise RuntimeError when ffmpeg, needed for purpose, is not on the PATH"""
+    if not shutil.which("ffmpeg"):
+        raise RuntimeError(f"{purpose} needs ffmpeg on the PATH")
+
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def concat_segments(paths, path):
+    """Join encoded segments into path without re-encoding (ffmpeg concat demuxer)"""
+    list_path = os.path.splitext(path)[0] + ".parts.txt"
+    with open(list_path, "w") as f:
+        for segment in paths:
+            f.write("file '{}'\n".format(os.path.abspath(segment).replace("'", "'\\''")))
+    try:
+        command = ["ffmpeg", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+                   "-c", "copy", path]
+        if subprocess.run(command).returncode != 0:
+            raise RuntimeError(f"ffmpeg could not join the segments of {path}")
+    finally:
+        os.remove(list_path)
+
+
+def run_encoders(commands, max_workers=None):
+    """Run ffmpeg commands, at most max_workers (default the CPU count) at once, raising if one fails"""
+    with ThreadPoolExecutor(max_workers or os.cpu_count()) as pool:
+        returncodes = list(pool.map(lambda command: subprocess.run(command).returncode, commands))
+    for command, returncode in zip(commands, returncodes):
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with code {returncode} while writing {command[-1]}")
+
+
+def encode_image_sequence(pattern, path, fps, n_frames, codec="libx264", pix_fmt=None, quality=None,
+                          segment_frames=0, max_workers=None):
+    """Encode a numbered image sequence (e.g. creator%03d.png) into path
+
+    With segment_frames > 0 the sequence is split into segments of that many frames, encoded
+    concurrently by separate ffmpeg processes (at most max_workers at once) and then joined
+    without re-encoding, so long clips use every core whatever the codec.
+    """
+    ranges = segment_ranges(n_frames, segment_frames)
+    outputs = [path] if len(ranges) == 1 else segment_paths(path, len(ranges))
+    commands = [
+        ["ffmpeg", "-loglevel", "error", "-y", "-framerate", str(fps), "-start_number", str(start), "-i", pattern,
+         "-frames:v", str(count)] + codec_args(codec, pix_fmt, quality) + [output]
+        for (start, count), output in zip(ranges, outputs)
+    ]
+    if len(ranges) == 1:
+        run_encoders(commands)
+        return
+    try:
+        run_encoders(commands, max_workers)
+        concat_segments(outputs, path)
+    finally:
+        remove_files(outputs)
+
+
+class PngSequenceWriter:
+    """Write frames as a numbered PNG sequence (creator000.png, creator001.png, ...), 8 or 16-bit
+
+    start is the number of the first frame written, to continue a sequence after a checkpoint.
+    """
+    def __init__(self, save_path, prefix="creator", compression=3, start=0):
+        self.save_path = save_path
+        self.prefix = prefix
+        self.compression = compression
+        self.count = start
+
+    def _next_filename(self):
+        filename = os.path.join(self.save_path, f'{self.prefix}{str(self.count).zfill(3)}.png')
+        self.count += 1
+        return filename
+
+    def write(self, frame):
+        cv2.imwrite(self._next_filename(), frame, [cv2.IMWRITE_PNG_COMPRESSION, self.compression])
+
+    def encode(self, frame):
+        """Return the PNG bytes of a frame, so encoding can run away from the writing process"""
+        ok, data = cv2.imencode('.png', frame, [cv2.IMWRITE_PNG_COMPRESSION, self.compression])
+        if not ok:
+            raise RuntimeError("PNG encoding failed")
+        return data
+
+    def write_encoded(self, data):
+        """Write PNG bytes produced by encode as the next frame"""
+        with open(self._next_filename(), "wb") as f:
+            f.write(data.tobytes())
+
+    def close(self):
+        pass
+
+
+class FFmpegPipeWriter:
+    """Stream raw frames into an ffmpeg subprocess through its stdin pipe"""
+    def __init__(self, path, fps, codec="libx264", pix_fmt="yuv420p", quality=None):
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.pix_fmt = pix_fmt
+        self.quality = quality
+        self._process = None
+
+    def _open(self, shape, dtype):
+        height, width = shape[:2]
+        input_pix_fmt = RAW_PIX_FMTS[(shape[2] if len(shape) == 3 else 1, np.dtype(dtype))]
+        command = [
+            "ffmpeg", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", input_pix_fmt, "-s", f"{width}x{height}", "-r", str(self.fps), "-i", "-",
+        ] + codec_args(self.codec, self.pix_fmt, self.quality) + [self.path]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        if self._process is None:
+            self._open(frame.shape, frame.dtype)
+        self._process.stdin.write(np.ascontiguousarray(frame).tobytes())
+
+    def write_bands(self, bands, shape, dtype):
+        """Write a frame of the given shape from consecutive bands of rows, without assembling it"""
+        if self._process is None:
+            self._open(shape, dtype)
+        for band in bands:
+            self._process.stdin.write(np.ascontiguousarray(band).tobytes())
+
+    def close(self):
+        if self._process is None:
+            return
+        self._process.stdin.close()
+        if self._process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self._process.returncode} while writing {self.path}")
+        self._process = None
+
+
+class OpenCVVideoWriter:
+    """Write frames with cv2.VideoWriter, opened lazily from the first frame size"""
+    def __init__(self, path, fps, fourcc="MJPG"):
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self._video = None
+
+    def write(self, frame):
+        if frame.dtype != np.uint8:
+            raise ValueError("cv2.VideoWriter only writes 8-bit frames here, install ffmpeg for 16-bit video")
+        if self._video is None:
+            height, width = frame.shape[:2]
+            self._video = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps,
+                                          (width, height), isColor=frame.ndim == 3)
+        self._video.write(frame)
+
+    def close(self):
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+
+
+def open_stream_writer(path, fps, codec="libx264", pix_fmt="yuv420p", quality=None, fallback=True):
+    """Return an in-process streaming video writer, using ffmpeg when it is on the PATH
+
+    Without ffmpeg, 8-bit video falls back to MJPG through cv2.VideoWriter, which drops codec,
+    pix_fmt and quality. With fallback=False (a codec or quality was asked for), or for 16-bit
+    pixel formats, RuntimeError is raised here instead, before any frame is rendered.
+    """
+    if shutil.which("ffmpeg"):
+        return FFmpegPipeWriter(path, fps, codec, pix_fmt, quality)
+    if not fallback or "16" in pix_fmt:
+        require_ffmpeg(f"Writing {codec} video ({pix_fmt}" + (f", quality {quality})" if quality is not None else ")"))
+    print("ffmpeg not found, falling back to cv2.VideoWriter (MJPG).")
+    return OpenCVVideoWriter(path, fps)
+
+
+def open_video_writer(path, fps, codec, pix_fmt=None, quality=None):
+    """Return a writer for an ffmpeg codec of VIDEO_CODECS or a cv2.VideoWriter FourCC such as mp4v
+
+    The ffmpeg codecs have no fallback: a missing ffmpeg raises RuntimeError here.
+    """
+    if codec in VIDEO_CODECS:
+        require_ffmpeg(f"Writing {codec} video")
+        return FFmpegPipeWriter(path, fps, codec, pix_fmt or VIDEO_CODECS[codec], quality)
+    return OpenCVVideoWriter(path, fps, codec)
+
+
+class PartedVideoWriter:
+    """Write a video as one part per interval frames, joined without re-encoding once every frame is written
+
+    Each part is a complete file as soon as its last frame is written, so a run resumed from a
+    checkpoint taken at a part boundary (start) keeps the parts before it and re-encodes nothing.
+    open_part(path) returns the writer of a part. Closing before the last frame keeps the parts.
+    The parts are joined with ffmpeg, so a missing ffmpeg is reported here, before any frame.
+    """
+    def __init__(self, path, open_part, interval, n_frames, start=0, ext=".mkv"):
+        require_ffmpeg("Joining the video parts of a checkpointed run")
+        self.path = path
+        self.open_part = open_part
+        self.interval = interval
+        self.n_frames = n_frames
+        self.count = start
+        self.parts = segment_paths(path, (n_frames + interval - 1) // interval, ext)
+        self._writer = None
+
+    def _next(self):
+        if self._writer is None:
+            self._writer = self.open_part(self.parts[self.count // self.interval])
+        return self._writer
+
+    def _advance(self):
+        self.count += 1
+        if self.count % self.interval == 0:
+            self._writer.close()
+            self._writer = None
+
+    def write(self, frame):
+        self._next().write(frame)
+        self._advance()
+
+    def write_bands(self, bands, shape, dtype):
+        writer = self._next()
+        if hasattr(writer, "write_bands"):
+            writer.write_bands(bands, shape, dtype)
+        else:
+            writer.write(np.concatenate(list(bands)))
+        self._advance()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.count == self.n_frames:
+            concat_segments(self.parts, self.path)
+            remove_files(self.parts)